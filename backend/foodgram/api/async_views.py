@@ -0,0 +1,79 @@
+"""
+Асинхронные обёртки view для режима ASGI.
+Django 3.2 выполняет синхронные view под ASGI в одном общем потоке,
+а асинхронного ORM в нём ещё нет. Поэтому view API запускаются в
+отдельном пуле из settings.ASYNC_VIEW_THREADS потоков: медленные клиенты
+обслуживает цикл событий uvicorn, а ожидание базы занимает поток пула,
+а не весь воркер
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import URLPattern
+
+from .instrumentation import current_metrics, record_queries
+from .signals import check_connections
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_VIEW_THREADS, thread_name_prefix='views'
+)
+
+
+def run_view(view, request, args, kwargs):
+    """
+    Потоки пула не проходят через сигналы request_started и
+    request_finished, поэтому устаревшие и неотвечающие соединения
+    закрываются здесь.
+    Ответ DRF отрисовывается в том же потоке, чтобы сериализация
+    в JSON не попала в общий поток Django.
+    Потоковый ответ тоже читается здесь целиком: ASGIHandler перебирает
+    его части в цикле событий, где ORM недоступен, а генератор может
+    читать строки из базы (например, список покупок)
+    """
+    close_old_connections()
+    check_connections()
+    try:
+        with record_queries(current_metrics.get()):
+            response = view(request, *args, **kwargs)
+            if callable(getattr(response, 'render', None)):
+                response.render()
+            if response.streaming:
+                response.streaming_content = list(
+                    response.streaming_content
+                )
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_view(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            executor,
+            context.run, partial(run_view, view, request, args, kwargs)
+        )
+    return wrapper
+
+
+def async_patterns(urlpatterns):
+    """
+    В режиме ASGI (settings.SERVER_MODE = 'asgi') заменяет view
+    в urlpatterns на async_view, в режиме WSGI возвращает их как есть
+    """
+    if settings.SERVER_MODE != 'asgi':
+        return urlpatterns
+    return [
+        URLPattern(
+            pattern.pattern, async_view(pattern.callback),
+            pattern.default_args, pattern.name
+        )
+        if isinstance(pattern, URLPattern) else pattern
+        for pattern in urlpatterns
+    ]
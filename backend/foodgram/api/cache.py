@@ -0,0 +1,126 @@
+import hashlib
+import threading
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import Tag, Ingredient
+from .metrics import observe_cache
+from .serializers import TagSerializer, IngredientSerializer
+
+
+class VersionedCache:
+    """
+    Общий для всех воркеров токен версии в кэше Django.
+    Смена токена делает недействительными все ранее сохранённые данные.
+    Кэш Django должен быть общим для всех процессов (по умолчанию
+    файловый), иначе сброс из management-команды их не затронет
+    """
+
+    def __init__(self, name):
+        self.version_key = f'{name}:version'
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid4().hex, timeout=None)
+            version = cache.get(self.version_key)
+        return version
+
+    def invalidate(self):
+        cache.set(self.version_key, uuid4().hex, timeout=None)
+
+
+class CatalogueCache(VersionedCache):
+    """
+    Кэш почти неизменяемого справочника в памяти процесса.
+    Готовый JSON хранится в каждом воркере, а общий ключ версии —
+    в кэше Django, поэтому изменение в одном воркере сбрасывает
+    кэш во всех остальных. Копия в памяти к тому же живёт не дольше
+    settings.CATALOGUE_CACHE_TTL секунд
+    """
+
+    def __init__(self, name, queryset, serializer_class):
+        super().__init__(f'catalogue:{name}')
+        self.name = name
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self.version = None
+        self.content = None
+        self.built_at = None
+        self.lock = threading.Lock()
+
+    def build(self):
+        return JSONRenderer().render(
+            self.serializer_class(self.queryset.all(), many=True).data
+        )
+
+    def is_fresh(self, version):
+        return version == self.version and (
+            time.monotonic() - self.built_at < settings.CATALOGUE_CACHE_TTL
+        )
+
+    def get(self):
+        version = self.get_version()
+        observe_cache(self.name, self.is_fresh(version))
+        if not self.is_fresh(version):
+            with self.lock:
+                if not self.is_fresh(version):
+                    self.content = self.build()
+                    self.version = version
+                    self.built_at = time.monotonic()
+        return self.content
+
+
+class ResponseCache(VersionedCache):
+    """
+    Кэш сериализованных ответов для анонимных пользователей.
+    Ключ строится из адреса сервера, пути и параметров query_params,
+    данные хранятся в отдельном кэше settings.RESPONSE_CACHE_ALIAS
+    """
+
+    def __init__(self, name, query_params):
+        super().__init__(f'responses:{name}')
+        self.name = name
+        self.query_params = query_params
+
+    @property
+    def storage(self):
+        return caches[settings.RESPONSE_CACHE_ALIAS]
+
+    def make_key(self, request):
+        # ?cursor= включает курсорную пагинацию, поэтому пустой параметр
+        # и его отсутствие дают разные ключи
+        params = '&'.join(
+            f'{param}=' + ','.join(
+                sorted(request.query_params.getlist(param))
+            )
+            for param in self.query_params
+            if param in request.query_params
+        )
+        url = f'{request.build_absolute_uri(request.path)}?{params}'
+        return (
+            f'responses:{self.name}:{self.get_version()}:'
+            f'{hashlib.md5(url.encode()).hexdigest()}'
+        )
+
+    def get(self, key):
+        data = self.storage.get(key)
+        observe_cache(self.name, data is not None)
+        return data
+
+    def set(self, key, data):
+        self.storage.set(key, data, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+
+
+ingredients_cache = CatalogueCache(
+    'ingredients', Ingredient.objects.order_by('pk'), IngredientSerializer
+)
+tags_cache = CatalogueCache('tags', Tag.objects.order_by('pk'), TagSerializer)
+recipes_cache = ResponseCache(
+    'recipes',
+    query_params=('page', 'cursor', 'limit', 'tags', 'author', 'ordering')
+)
@@ -0,0 +1,89 @@
+import base64
+import binascii
+import io
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+
+class RecipeImageField(Base64ImageField):
+    """
+    Картинка рецепта в виде base64-строки или файла из multipart/form-data.
+    Размер файла и картинки проверяются до декодирования изображения
+    """
+    default_error_messages = {
+        'too_large': (
+            'Размер картинки не должен превышать {max_size} байт'
+        ),
+        'too_big_dimensions': (
+            'Стороны картинки не должны превышать {max_dimension} пикселей'
+        ),
+    }
+
+    def check_size(self, size):
+        if size > settings.FILE_UPLOAD_MAX_SIZE:
+            self.fail('too_large', max_size=settings.FILE_UPLOAD_MAX_SIZE)
+
+    def check_dimensions(self, file):
+        """
+        Image.open читает только заголовок файла, пиксели не декодируются
+        """
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+        except Exception:
+            # Некорректный файл отклонит проверка ImageField
+            return
+        finally:
+            file.seek(0)
+        max_dimension = settings.RECIPE_IMAGE_MAX_DIMENSION
+        if width > max_dimension or height > max_dimension:
+            self.fail('too_big_dimensions', max_dimension=max_dimension)
+
+    def get_oversized_uploads(self):
+        request = self.context.get('request')
+        return getattr(request, 'oversized_uploads', ())
+
+    def validate_empty_values(self, data):
+        if self.field_name in self.get_oversized_uploads():
+            self.fail('too_large', max_size=settings.FILE_UPLOAD_MAX_SIZE)
+        return super().validate_empty_values(data)
+
+    def decode(self, data):
+        """
+        Повторяет разбор base64 из Base64FieldMixin, чтобы проверить
+        размеры по заголовку до проверки ImageField, которая открывает
+        картинку через Pillow целиком
+        """
+        header, _, base64_data = data.rpartition(';base64,')
+        self.check_size(len(base64_data) * 3 // 4)
+        try:
+            decoded_file = base64.b64decode(base64_data)
+        except (TypeError, binascii.Error, ValueError):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        self.check_dimensions(io.BytesIO(decoded_file))
+
+        file_name = self.get_file_name(decoded_file)
+        file_extension = self.get_file_extension(file_name, decoded_file)
+        if file_extension not in self.ALLOWED_TYPES:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        content_type = None
+        if header and self.trust_provided_content_type:
+            content_type = header.replace('data:', '')
+        return SimpleUploadedFile(
+            name=f'{file_name}.{file_extension}',
+            content=decoded_file,
+            content_type=content_type
+        )
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) and data not in self.EMPTY_VALUES:
+            data = self.decode(data)
+        if isinstance(data, UploadedFile):
+            self.check_size(data.size)
+            self.check_dimensions(data)
+            return serializers.ImageField.to_internal_value(self, data)
+        return super().to_internal_value(data)
@@ -1,8 +1,15 @@
+from django.db import connections
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Length
 from django_filters.rest_framework import FilterSet, filters
-from recipes.models import Recipe
+from rest_framework.filters import BaseFilterBackend
+
+from recipes.models import Favourite, Recipe, ShoppingCart
 
 
 class RecipeFilter(FilterSet):
+    author = filters.NumberFilter(field_name='author')
+    tags = filters.CharFilter(method='filter_tags')
     is_favorited = filters.BooleanFilter(
         method='get_queryset'
     )
@@ -11,20 +18,85 @@ class RecipeFilter(FilterSet):
     )
 
     def get_queryset(self, queryset, name, value):
+        """
+        Оба значения фильтра — полусоединение по уникальному индексу
+        (user, recipe): EXISTS для 1 и NOT EXISTS для 0
+        """
         user = self.request.user
-        if user.is_authenticated:
-            if name == 'is_favorited':
-                list_of_recipes_ids = user.favourite.values('recipe_id')
-            if name == 'is_in_shopping_cart':
-                list_of_recipes_ids = user.shoppingcart.values('recipe_id')
-
-            query_param = self.request.query_params.get(name)
-            if query_param == '1':
-                queryset = queryset.filter(id__in=list_of_recipes_ids)
-            if query_param == '0':
-                queryset = queryset.exclude(id__in=list_of_recipes_ids)
-        return queryset
+        if not user.is_authenticated or value is None:
+            return queryset
+        model = Favourite if name == 'is_favorited' else ShoppingCart
+        relation = Exists(
+            model.objects.filter(user=user, recipe_id=OuterRef('pk'))
+        )
+        if value:
+            return queryset.filter(relation)
+        return queryset.filter(~relation)
+
+    def filter_tags(self, queryset, name, value):
+        tags = self.request.query_params.getlist(name)
+        return queryset.filter(
+            Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe_id=OuterRef('pk'), tag__slug__in=tags
+                )
+            )
+        )
 
     class Meta:
         model = Recipe
-        fields = ('is_favorited', 'is_in_shopping_cart',)
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',)
+
+
+class IngredientSearchFilter(BaseFilterBackend):
+    """
+    Поиск ингредиентов для автодополнения двумя запросами: сначала
+    совпадения по началу названия (LIKE 'x%' по B-tree индексу
+    с varchar_pattern_ops), затем, если их не хватило до limit, совпадения
+    по вхождению (LIKE '%x%' по GIN индексу pg_trgm), отсортированные
+    по похожести. На SQLite похожесть заменяется длиной названия
+    """
+    search_param = 'name'
+    limit_param = 'limit'
+
+    def get_limit(self, request):
+        limit = request.query_params.get(self.limit_param)
+        if limit and limit.isdigit() and int(limit) > 0:
+            return int(limit)
+        return None
+
+    @staticmethod
+    def prefix_queryset(queryset, name):
+        return queryset.filter(name__startswith=name).order_by(
+            Length('name'), 'name'
+        )
+
+    @staticmethod
+    def contains_queryset(queryset, name):
+        queryset = queryset.filter(name__contains=name).exclude(
+            name__startswith=name
+        )
+        if connections[queryset.db].vendor == 'postgresql':
+            from django.contrib.postgres.search import TrigramSimilarity
+
+            return queryset.annotate(
+                similarity=TrigramSimilarity('name', name)
+            ).order_by('-similarity', 'name')
+        return queryset.order_by(Length('name'), 'name')
+
+    def filter_queryset(self, request, queryset, view):
+        name = request.query_params.get(self.search_param)
+        if not name or getattr(view, 'action', 'list') != 'list':
+            return queryset
+
+        limit = self.get_limit(request)
+        prefix = self.prefix_queryset(queryset, name)
+        if limit:
+            prefix = prefix[:limit]
+        results = list(prefix)
+        if limit and len(results) >= limit:
+            return results
+        contains = self.contains_queryset(queryset, name)
+        if limit:
+            contains = contains[:limit - len(results)]
+        return results + list(contains)
@@ -0,0 +1,111 @@
+"""
+Сбор метрик запроса к API: число SQL-запросов, время в базе,
+повторяющиеся запросы и время сериализации.
+Метрики текущего запроса хранятся в contextvars, поэтому
+не смешиваются между потоками и корутинами
+"""
+import contextvars
+import hashlib
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def fingerprint(sql):
+    """
+    Шаблон запроса без значений: запросы, отличающиеся только
+    параметрами или длиной списка IN, получают один отпечаток
+    """
+    normalized = LITERAL.sub('?', IN_LIST.sub('(...)', sql))
+    return hashlib.md5(normalized.encode()).hexdigest()[:12]
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.fingerprints = Counter()
+        self.examples = {}
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        key = fingerprint(sql)
+        self.fingerprints[key] += 1
+        self.examples.setdefault(key, sql)
+
+    @property
+    def duplicates(self):
+        return {
+            key: count for key, count in self.fingerprints.items()
+            if count > 1
+        }
+
+
+class QueryRecorder:
+    """Обёртка для connection.execute_wrapper"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.metrics.record_query(sql, time.perf_counter() - start)
+
+
+@contextmanager
+def record_queries(metrics):
+    """
+    Подключает QueryRecorder ко всем соединениям текущего потока.
+    Соединения Django у каждого потока свои, поэтому обёртку нужно
+    ставить в том потоке, где выполняется view
+    """
+    if metrics is None:
+        yield
+        return
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(
+                connection.execute_wrapper(QueryRecorder(metrics))
+            )
+        yield
+
+
+@contextmanager
+def serializer_timer():
+    """
+    Учитывает только внешний вызов: вложенные сериализаторы
+    выполняются внутри него и второй раз не считаются.
+    Запросы к базе во время сериализации остаются в её времени
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    metrics.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_depth -= 1
+        if not metrics.serializer_depth:
+            metrics.serializer_time += time.perf_counter() - start
+
+
+class TimedSerializerMixin:
+    def to_representation(self, instance):
+        with serializer_timer():
+            return super().to_representation(instance)
@@ -0,0 +1,241 @@
+import json
+import platform
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Recipe, Ingredient
+from users.models import Follow
+from api.middleware import get_query_budget
+from .seed_benchmark_data import BENCHMARK_PREFIX
+
+User = get_user_model()
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = max(0, int(round(percent / 100 * len(ordered))) - 1)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measuring latency, number of queries and allocated memory '
+        'of API endpoints on data created by seed_benchmark_data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--only', nargs='*', default=None,
+            help='Names of endpoints to benchmark'
+        )
+        parser.add_argument(
+            '--output', help='Path to JSON file, stdout by default'
+        )
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Fail if an endpoint exceeds its query budget'
+        )
+
+    def handle(self, *args, **options):
+        self.iterations = options['iterations']
+        self.warmup = options['warmup']
+        user = (
+            User.objects.filter(username__startswith=BENCHMARK_PREFIX)
+            .annotate(carted=Count('shoppingcart'))
+            .order_by('-carted', 'pk').first()
+        )
+        if user is None:
+            raise CommandError('Run seed_benchmark_data first')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        recipe = Recipe.objects.exclude(author=user).order_by('pk').first()
+        author = User.objects.exclude(pk=user.pk).exclude(
+            pk__in=Follow.objects.filter(user=user).values('author_id')
+        ).order_by('pk').first()
+        ingredient_prefix = Ingredient.objects.order_by('pk').first().name[:3]
+
+        results = []
+        benchmarks = self.get_benchmarks(recipe, author, ingredient_prefix)
+        for benchmark in benchmarks:
+            if options['only'] and benchmark['name'] not in options['only']:
+                continue
+            result = self.run_benchmark(**benchmark)
+            results.append(result)
+            self.stderr.write(
+                f'{result["name"]:<28} p50={result["p50_ms"]:8.2f}ms '
+                f'p95={result["p95_ms"]:8.2f}ms '
+                f'queries={result["queries"]:<4} '
+                f'peak={result["peak_memory_kb"]:.0f}KiB'
+            )
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'iterations': self.iterations,
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+            },
+            'results': results,
+        }
+        dump = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(dump)
+        else:
+            self.stdout.write(dump)
+
+        over_budget = [
+            result['name'] for result in results if result['over_budget']
+        ]
+        if options['strict'] and over_budget:
+            raise CommandError(
+                'Query budget exceeded: ' + ', '.join(over_budget)
+            )
+
+    @staticmethod
+    def get_benchmarks(recipe, author, ingredient_prefix):
+        """
+        Описание замеряемых запросов: для парных действий (POST/DELETE)
+        teardown возвращает базу в исходное состояние после каждой итерации
+        """
+        recipe_url = f'/api/recipes/{recipe.pk}/'
+        subscribe_url = f'/api/users/{author.pk}/subscribe/'
+        return (
+            {'name': 'recipes_list', 'url': '/api/recipes/'},
+            {
+                'name': 'recipes_list_limit_50',
+                'url': '/api/recipes/?limit=50'
+            },
+            {
+                'name': 'recipes_list_tags',
+                'url': '/api/recipes/?tags=breakfast&tags=lunch'
+            },
+            {
+                'name': 'recipes_list_popular',
+                'url': '/api/recipes/?ordering=popular&cursor='
+            },
+            {'name': 'recipe_detail', 'url': recipe_url},
+            {
+                'name': 'subscriptions',
+                'url': '/api/users/subscriptions/?recipes_limit=3'
+            },
+            {
+                'name': 'ingredients_search',
+                'url': f'/api/ingredients/?name={ingredient_prefix}'
+            },
+            {
+                'name': 'download_shopping_cart',
+                'url': '/api/recipes/download_shopping_cart/'
+            },
+            {
+                'name': 'favorite_add', 'method': 'post',
+                'url': recipe_url + 'favorite/',
+                'teardown': ('delete', recipe_url + 'favorite/')
+            },
+            {
+                'name': 'favorite_remove', 'method': 'delete',
+                'url': recipe_url + 'favorite/',
+                'setup': ('post', recipe_url + 'favorite/')
+            },
+            {
+                'name': 'shopping_cart_add', 'method': 'post',
+                'url': recipe_url + 'shopping_cart/',
+                'teardown': ('delete', recipe_url + 'shopping_cart/')
+            },
+            {
+                'name': 'shopping_cart_remove', 'method': 'delete',
+                'url': recipe_url + 'shopping_cart/',
+                'setup': ('post', recipe_url + 'shopping_cart/')
+            },
+            {
+                'name': 'subscribe', 'method': 'post', 'url': subscribe_url,
+                'teardown': ('delete', subscribe_url)
+            },
+            {
+                'name': 'unsubscribe', 'method': 'delete',
+                'url': subscribe_url,
+                'setup': ('post', subscribe_url)
+            },
+        )
+
+    def request(self, method, url):
+        response = getattr(self.client, method)(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def run_benchmark(self, name, url, method='get',
+                      setup=None, teardown=None):
+        # Бюджет тот же, что проверяет QueryInstrumentationMiddleware
+        view_name = resolve(urlsplit(url).path).view_name
+        budget = get_query_budget(method.upper(), view_name)
+
+        def run_once(measure):
+            if setup:
+                self.request(*setup)
+            result = measure()
+            if teardown:
+                self.request(*teardown)
+            return result
+
+        def timed():
+            start = time.perf_counter()
+            response = self.request(method, url)
+            return time.perf_counter() - start, response.status_code
+
+        def counted():
+            with CaptureQueriesContext(connection) as context:
+                self.request(method, url)
+            return len(context.captured_queries)
+
+        def traced():
+            tracemalloc.start()
+            self.request(method, url)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return peak
+
+        for _ in range(self.warmup):
+            run_once(timed)
+        timings = []
+        statuses = set()
+        for _ in range(self.iterations):
+            duration, status_code = run_once(timed)
+            timings.append(duration * 1000)
+            statuses.add(status_code)
+        queries = run_once(counted)
+        peak = run_once(traced)
+
+        return {
+            'name': name,
+            'method': method.upper(),
+            'url': url,
+            'view': view_name,
+            'status_codes': sorted(statuses),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'queries': queries,
+            'query_budget': budget,
+            'over_budget': budget is not None and queries > budget,
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
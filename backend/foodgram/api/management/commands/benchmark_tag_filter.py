@@ -0,0 +1,160 @@
+import json
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from recipes.models import Tag, Recipe
+from .benchmark_api import percentile
+from .seed_benchmark_data import Command as SeedCommand
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Comparing tag filtering of the recipe feed with DISTINCT over '
+        'a join and with an EXISTS semi-join on the current data '
+        'or at several numbers of recipes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tags', nargs='+', default=None,
+            help='Tag slugs, all tags by default'
+        )
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument(
+            '--scales', nargs='+', type=int, default=None,
+            help=(
+                'Numbers of recipes to measure at, missing recipes are '
+                'seeded in a transaction that is rolled back afterwards'
+            )
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--output', help='Path to JSON file, stdout by default'
+        )
+
+    def handle(self, *args, **options):
+        tags = options['tags'] or list(
+            Tag.objects.values_list('slug', flat=True)
+        )
+        if not tags:
+            raise CommandError('Run seed_benchmark_data first')
+        self.tags = tags
+        self.page_size = options['page_size']
+        self.iterations = options['iterations']
+
+        results = []
+        if options['scales']:
+            with transaction.atomic():
+                for scale in sorted(options['scales']):
+                    self.top_up(scale, options['seed'])
+                    results.extend(self.measure())
+                # Добавленные рецепты не остаются в базе
+                transaction.set_rollback(True)
+            self.add_growth(results)
+        else:
+            results = self.measure()
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'recipes': Recipe.objects.count(),
+                'recipe_tags': Recipe.tags.through.objects.count(),
+                'tags': tags,
+                'iterations': self.iterations,
+                'scales': sorted(options['scales'] or []),
+            },
+            'results': results,
+        }
+        dump = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(dump)
+        else:
+            self.stdout.write(dump)
+
+    def top_up(self, scale, seed):
+        """
+        Дополняет рецепты до scale синтетическими рецептами
+        seed_benchmark_data без ингредиентов: фильтр по тегам их не читает
+        """
+        missing = scale - Recipe.objects.count()
+        if missing <= 0:
+            if missing < 0:
+                self.stderr.write(
+                    f'Database already has more than {scale} recipes, '
+                    f'measuring on {scale - missing}'
+                )
+            return
+        user_ids = list(User.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        if not user_ids:
+            raise CommandError('Run seed_benchmark_data first')
+        seeder = SeedCommand()
+        seeder.batch_size = 5000
+        seeder.random = random.Random(seed + scale)
+        seeder.seed_recipes(missing, user_ids, tag_ids, [], 0)
+
+    def measure(self):
+        recipes = Recipe.objects.order_by('-created', '-id')
+        strategies = {
+            'distinct': recipes.filter(tags__slug__in=self.tags).distinct(),
+            'exists': recipes.filter(
+                Exists(
+                    Recipe.tags.through.objects.filter(
+                        recipe_id=OuterRef('pk'), tag__slug__in=self.tags
+                    )
+                )
+            ),
+        }
+        total = Recipe.objects.count()
+
+        results = []
+        for name, queryset in strategies.items():
+            count = queryset.count()
+            last_page = max(0, (count - 1) // self.page_size) * self.page_size
+            for page, offset in (('first', 0), ('last', last_page)):
+                timings = []
+                for _ in range(self.iterations):
+                    start = time.perf_counter()
+                    queryset.count()
+                    list(queryset[offset:offset + self.page_size])
+                    timings.append((time.perf_counter() - start) * 1000)
+                results.append({
+                    'recipes': total,
+                    'strategy': name,
+                    'page': page,
+                    'offset': offset,
+                    'matched': count,
+                    'p50_ms': round(percentile(timings, 50), 3),
+                    'p95_ms': round(percentile(timings, 95), 3),
+                })
+                self.stderr.write(
+                    f'{total:>8} {name:<9} {page:<6} '
+                    f'p50={results[-1]["p50_ms"]:8.2f}ms '
+                    f'p95={results[-1]["p95_ms"]:8.2f}ms'
+                )
+        return results
+
+    @staticmethod
+    def add_growth(results):
+        """
+        growth — во сколько раз p50 больше, чем на наименьшем масштабе,
+        при линейной стоимости он растёт вместе с числом рецептов
+        """
+        smallest = {}
+        for result in results:
+            key = (result['strategy'], result['page'])
+            base = smallest.setdefault(key, result)
+            result['growth'] = round(
+                result['p50_ms'] / max(base['p50_ms'], 0.001), 2
+            )
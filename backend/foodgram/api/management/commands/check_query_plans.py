@@ -0,0 +1,200 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from recipes.models import Ingredient, Recipe
+from api.filters import IngredientSearchFilter
+from api.views import RecipeViewSet, SubscribtionsView
+from .seed_benchmark_data import BENCHMARK_PREFIX
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Capturing EXPLAIN plans of the main API queries and checking '
+        'that PostgreSQL uses the expected indexes. Run on data created '
+        'by seed_benchmark_data, the planner prefers sequential scans '
+        'on small tables'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Run EXPLAIN ANALYZE (PostgreSQL only)'
+        )
+        parser.add_argument(
+            '--output', help='Path to JSON file with captured plans'
+        )
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Fail if a query does not use an expected index'
+        )
+
+    def make_request(self, url, user):
+        request = Request(RequestFactory().get(url))
+        request.user = user
+        return request
+
+    def recipes_queryset(self, url, user):
+        view = RecipeViewSet(
+            request=self.make_request(url, user), action='list',
+            format_kwarg=None, kwargs={}
+        )
+        return view.filter_queryset(view.get_queryset())[:10]
+
+    def get_checks(self, user, author):
+        """
+        Запросы в том виде, в каком их строят view, и индексы,
+        которые должен выбрать планировщик PostgreSQL
+        """
+        subscriptions = SubscribtionsView(
+            request=self.make_request('/api/users/subscriptions/', user)
+        )
+        cart_amounts = RecipeViewSet.get_shopping_cart_amounts(user)
+        ingredient_prefix = Ingredient.objects.order_by('pk').values_list(
+            'name', flat=True
+        ).first()[:2]
+        return (
+            (
+                'recipes_feed',
+                self.recipes_queryset('/api/recipes/', user),
+                ('recipe_created_id_idx',)
+            ),
+            (
+                'recipes_by_author',
+                self.recipes_queryset(
+                    f'/api/recipes/?author={author.pk}', user
+                ),
+                ('recipe_author_created_idx',)
+            ),
+            (
+                'recipes_favorited',
+                self.recipes_queryset('/api/recipes/?is_favorited=1', user),
+                ('favourite_unique',)
+            ),
+            (
+                'recipes_not_favorited',
+                self.recipes_queryset('/api/recipes/?is_favorited=0', user),
+                ('favourite_unique',)
+            ),
+            (
+                'recipes_in_shopping_cart',
+                self.recipes_queryset(
+                    '/api/recipes/?is_in_shopping_cart=1', user
+                ),
+                ('shopping_cart_unique',)
+            ),
+            (
+                'recipes_popular',
+                self.recipes_queryset('/api/recipes/?ordering=popular', user),
+                ('recipe_score_popular_idx',)
+            ),
+            (
+                'subscriptions',
+                subscriptions.get_queryset()[:10],
+                ('follow_unique',)
+            ),
+            (
+                'subscriptions_latest_recipes',
+                Recipe.objects.latest_by_author(
+                    list(subscriptions.get_queryset().values_list(
+                        'pk', flat=True
+                    )[:10]),
+                    3
+                ),
+                ('recipe_author_created_idx',)
+            ),
+            (
+                'ingredients_prefix',
+                IngredientSearchFilter.prefix_queryset(
+                    Ingredient.objects.all(), ingredient_prefix
+                )[:10],
+                ('ingredient_name_prefix_idx',)
+            ),
+            (
+                'ingredients_contains',
+                IngredientSearchFilter.contains_queryset(
+                    Ingredient.objects.all(), ingredient_prefix
+                )[:10],
+                ('ingredient_name_trgm_idx',)
+            ),
+            (
+                'shopping_cart_ingredients',
+                RecipeViewSet.get_shopping_cart_ingredients(cart_amounts),
+                ('shopping_cart_unique', 'ingredient_amount_cover_idx')
+            ),
+        )
+
+    def explain(self, queryset, analyze):
+        if hasattr(queryset, 'raw_query'):
+            sql, params = queryset.raw_query, queryset.params
+        else:
+            sql, params = queryset.query.sql_with_params()
+        options = {'analyze': True} if analyze else {}
+        prefix = connection.ops.explain_query_prefix(**options)
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            return '\n'.join(
+                ' '.join(str(column) for column in row)
+                for row in cursor.fetchall()
+            )
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(username__startswith=BENCHMARK_PREFIX)
+        user = users.annotate(
+            carted=Count('shoppingcart')
+        ).order_by('-carted', 'pk').first()
+        author = users.order_by('-recipes_count', 'pk').first()
+        if user is None:
+            raise CommandError('Run seed_benchmark_data first')
+        postgresql = connection.vendor == 'postgresql'
+        if options['analyze'] and not postgresql:
+            raise CommandError('--analyze is supported only on PostgreSQL')
+        if not postgresql:
+            self.stderr.write(self.style.WARNING(
+                f'Index names are checked only on PostgreSQL, '
+                f'{connection.vendor} plans are printed as is'
+            ))
+
+        results = []
+        for name, queryset, indexes in self.get_checks(user, author):
+            plan = self.explain(queryset, options['analyze'])
+            missing = [index for index in indexes if index not in plan]
+            passed = not postgresql or not missing
+            results.append({
+                'name': name,
+                'expected_indexes': indexes,
+                'missing_indexes': missing if postgresql else [],
+                'passed': passed,
+                'plan': plan,
+            })
+            if passed:
+                self.stdout.write(self.style.SUCCESS(f'{name}: ok'))
+            else:
+                self.stdout.write(self.style.ERROR(
+                    f'{name}: missing {", ".join(missing)}'
+                ))
+            self.stdout.write(plan + '\n')
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(
+                    {
+                        'vendor': connection.vendor,
+                        'rows': {
+                            'recipes': Recipe.objects.count(),
+                            'users': users.count(),
+                        },
+                        'checks': results,
+                    },
+                    file, ensure_ascii=False, indent=2
+                )
+        failed = [result['name'] for result in results if not result['passed']]
+        if failed and options['strict']:
+            raise CommandError(f'Expected indexes are not used: {failed}')
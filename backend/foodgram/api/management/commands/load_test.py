@@ -0,0 +1,243 @@
+import asyncio
+import json
+import platform
+import random
+import time
+from collections import Counter
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from recipes.models import Ingredient, Recipe
+from .benchmark_api import percentile
+
+READ_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/{recipe}/',
+    '/api/ingredients/?name={ingredient}',
+    '/api/tags/',
+)
+
+
+class Connection:
+    """
+    Минимальный клиент HTTP/1.1 на asyncio: держит одно соединение
+    и переоткрывает его, если сервер закрыл его после ответа
+    (синхронные воркеры gunicorn не поддерживают keep-alive)
+    """
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def get(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        self.writer.write((
+            f'GET {path} HTTP/1.1\r\nHost: {self.host}\r\n'
+            'Accept: application/json\r\n\r\n'
+        ).encode())
+        try:
+            return await asyncio.wait_for(self.read_response(), self.timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def read_response(self):
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        status = int(status_line.split()[1])
+        headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip().lower()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+        elif 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        else:
+            await self.reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection') == 'close':
+            await self.close()
+        return status
+
+
+class Command(BaseCommand):
+    help = (
+        'Load testing read-only API endpoints of a running server with '
+        'many concurrent keep-alive connections, e.g. to compare the '
+        'WSGI and ASGI modes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url', help='Server address, e.g. http://127.0.0.1:8000'
+        )
+        parser.add_argument('--concurrency', type=int, default=500)
+        parser.add_argument(
+            '--duration', type=float, default=30, help='Seconds'
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=30,
+            help='Seconds to wait for one response'
+        )
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help=(
+                'Path to request, may be repeated. {recipe} and '
+                '{ingredient} are replaced with existing values'
+            )
+        )
+        parser.add_argument(
+            '--label', default='', help='Name of the setup, e.g. asgi'
+        )
+        parser.add_argument(
+            '--baseline', help='JSON report of a previous run to compare'
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--output', help='Path to JSON file, stdout by default'
+        )
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('Only http://host[:port] URLs are supported')
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = options['timeout']
+        self.random = random.Random(options['seed'])
+        self.paths = self.get_paths(options['paths'] or READ_PATHS)
+        self.deadline = None
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = Counter()
+
+        started = time.perf_counter()
+        asyncio.run(self.run(options['concurrency'], options['duration']))
+        elapsed = time.perf_counter() - started
+
+        completed = len(self.latencies)
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'label': options['label'],
+                'url': options['url'],
+                'python': platform.python_version(),
+                'concurrency': options['concurrency'],
+                'duration': round(elapsed, 2),
+                'paths': sorted(set(self.paths)),
+            },
+            'requests': completed,
+            'requests_per_second': round(completed / elapsed, 1),
+            'statuses': dict(self.statuses),
+            'errors': dict(self.errors),
+            'p50_ms': self.latency(50),
+            'p95_ms': self.latency(95),
+            'p99_ms': self.latency(99),
+        }
+        if options['baseline']:
+            report['baseline'] = self.compare(report, options['baseline'])
+        self.stderr.write(
+            f'{options["label"] or "load_test"}: '
+            f'{report["requests_per_second"]} req/s, '
+            f'p50={report["p50_ms"]}ms p95={report["p95_ms"]}ms '
+            f'p99={report["p99_ms"]}ms, '
+            f'errors={sum(self.errors.values())}'
+        )
+
+        dump = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(dump)
+        else:
+            self.stdout.write(dump)
+
+    def get_paths(self, templates):
+        """
+        Подставляет в шаблоны путей id случайных рецептов и начала
+        названий ингредиентов из базы, с которой работает сервер
+        """
+        recipes = list(
+            Recipe.objects.order_by('-pk').values_list('pk', flat=True)[:100]
+        )
+        ingredients = list(
+            Ingredient.objects.order_by('pk')
+            .values_list('name', flat=True)[:100]
+        )
+        paths = []
+        for template in templates:
+            if '{recipe}' in template and not recipes:
+                raise CommandError('Run seed_benchmark_data first')
+            if '{ingredient}' in template and not ingredients:
+                raise CommandError('Run load_data first')
+            for _ in range(10):
+                paths.append(quote(template.format(
+                    recipe=self.random.choice(recipes or [None]),
+                    ingredient=self.random.choice(ingredients or [''])[:2]
+                ), safe='/?=&'))
+        return paths
+
+    async def run(self, concurrency, duration):
+        self.deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            self.worker(random.Random(self.random.random()))
+            for _ in range(concurrency)
+        ))
+
+    async def worker(self, rng):
+        connection = Connection(self.host, self.port, self.timeout)
+        try:
+            while time.perf_counter() < self.deadline:
+                start = time.perf_counter()
+                try:
+                    status = await connection.get(rng.choice(self.paths))
+                except (OSError, asyncio.TimeoutError,
+                        asyncio.IncompleteReadError) as error:
+                    self.errors[type(error).__name__] += 1
+                    # Не перегружать сервер, который не принимает соединения
+                    await asyncio.sleep(0.1)
+                    continue
+                self.latencies.append(time.perf_counter() - start)
+                self.statuses[status] += 1
+                if status >= 400:
+                    self.errors[f'HTTP {status}'] += 1
+        finally:
+            await connection.close()
+
+    def latency(self, percent):
+        if not self.latencies:
+            return None
+        return round(percentile(self.latencies, percent) * 1000, 2)
+
+    @staticmethod
+    def compare(report, path):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        return {
+            'label': baseline['meta']['label'],
+            'requests_per_second': baseline['requests_per_second'],
+            'p95_ms': baseline['p95_ms'],
+            'throughput_ratio': round(
+                report['requests_per_second']
+                / max(baseline['requests_per_second'], 0.1), 2
+            ),
+        }
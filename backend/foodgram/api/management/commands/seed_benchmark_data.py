@@ -0,0 +1,199 @@
+import csv
+import os
+import random
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from recipes.counters import recount
+from recipes.management.commands.import_recipes import reset_sequences
+from recipes.models import (
+    Tag, Ingredient, Recipe, IngredientAmount, Favourite, ShoppingCart
+)
+from recipes.scores import refresh_scores
+from users.models import Follow
+from api.cache import ingredients_cache, tags_cache
+
+User = get_user_model()
+
+SCALES = {
+    'small': {'users': 1000, 'recipes': 1000},
+    'medium': {'users': 10000, 'recipes': 10000},
+    'large': {'users': 10000, 'recipes': 100000},
+}
+
+BENCHMARK_PREFIX = 'bench'
+BENCHMARK_PASSWORD = 'bench-password'
+
+TAGS = (
+    ('Завтрак', '#e26c2d', 'breakfast'),
+    ('Обед', '#49b64e', 'lunch'),
+    ('Ужин', '#8775d2', 'dinner'),
+    ('Десерт', '#f4a3c1', 'dessert'),
+    ('Выпечка', '#c49b63', 'bakery'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Seeding the database with synthetic data for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', choices=SCALES, default='small',
+            help='Preset for the number of users and recipes'
+        )
+        parser.add_argument('--users', type=int, help='Overrides --scale')
+        parser.add_argument('--recipes', type=int, help='Overrides --scale')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favourites-per-user', type=int, default=10)
+        parser.add_argument('--cart-per-user', type=int, default=10)
+        parser.add_argument('--follows-per-user', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        scale = SCALES[options['scale']]
+        users_count = options['users'] or scale['users']
+        recipes_count = options['recipes'] or scale['recipes']
+        self.batch_size = options['batch_size']
+        self.random = random.Random(options['seed'])
+
+        if User.objects.filter(
+            username__startswith=BENCHMARK_PREFIX
+        ).exists():
+            raise CommandError(
+                'Benchmark data is already present, use a clean database'
+            )
+
+        ingredient_ids = self.seed_ingredients()
+        tag_ids = self.seed_tags()
+        with transaction.atomic():
+            user_ids = self.seed_users(users_count)
+            recipe_ids = self.seed_recipes(
+                recipes_count, user_ids, tag_ids, ingredient_ids,
+                options['ingredients_per_recipe']
+            )
+            self.seed_user_collections(
+                Favourite, 'recipe_id', user_ids, recipe_ids,
+                options['favourites_per_user']
+            )
+            self.seed_user_collections(
+                ShoppingCart, 'recipe_id', user_ids, recipe_ids,
+                options['cart_per_user']
+            )
+            self.seed_user_collections(
+                Follow, 'author_id', user_ids, user_ids,
+                options['follows_per_user']
+            )
+            recount()
+        # Пользователи и рецепты вставлены с явными id
+        reset_sequences(User, Recipe)
+        refresh_scores()
+
+        ingredients_cache.invalidate()
+        tags_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(user_ids)} users, {len(recipe_ids)} recipes, '
+            f'{len(ingredient_ids)} ingredients'
+        ))
+
+    @staticmethod
+    def next_ids(model, count):
+        start = (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        return list(range(start, start + count))
+
+    def bulk_create(self, model, objs):
+        model.objects.bulk_create(
+            objs, batch_size=self.batch_size, ignore_conflicts=True
+        )
+
+    def seed_ingredients(self):
+        path_to_csv = os.path.join(
+            settings.BASE_DIR, 'data', 'ingredients.csv'
+        )
+        if not os.path.exists(path_to_csv):
+            raise CommandError('No file with ingredients')
+        with open(path_to_csv, encoding='utf-8') as file:
+            self.bulk_create(Ingredient, [
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in csv.reader(file)
+            ])
+        return list(Ingredient.objects.values_list('id', flat=True))
+
+    def seed_tags(self):
+        self.bulk_create(Tag, [
+            Tag(name=name, color=color, slug=slug)
+            for name, color, slug in TAGS
+        ])
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def seed_users(self, count):
+        password = make_password(BENCHMARK_PASSWORD)
+        ids = self.next_ids(User, count)
+        self.bulk_create(User, [
+            User(
+                id=id,
+                username=f'{BENCHMARK_PREFIX}{id}',
+                email=f'{BENCHMARK_PREFIX}{id}@example.com',
+                first_name='Бенчмарк',
+                last_name='Пользователь',
+                password=password
+            )
+            for id in ids
+        ])
+        return ids
+
+    def seed_recipes(self, count, user_ids, tag_ids, ingredient_ids,
+                     ingredients_per_recipe):
+        ids = self.next_ids(Recipe, count)
+        through = Recipe.tags.through
+        for start in range(0, count, self.batch_size):
+            chunk = ids[start:start + self.batch_size]
+            self.bulk_create(Recipe, [
+                Recipe(
+                    id=id,
+                    name=f'Рецепт {id}',
+                    text='Смешать все ингредиенты и подавать к столу. ' * 5,
+                    author_id=self.random.choice(user_ids),
+                    image='recipes/benchmark.png',
+                    cooking_time=self.random.randint(1, 300)
+                )
+                for id in chunk
+            ])
+            self.bulk_create(through, [
+                through(recipe_id=id, tag_id=tag_id)
+                for id in chunk
+                for tag_id in self.random.sample(
+                    tag_ids, self.random.randint(1, min(3, len(tag_ids)))
+                )
+            ])
+            self.bulk_create(IngredientAmount, [
+                IngredientAmount(
+                    recipe_id=id,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500)
+                )
+                for id in chunk
+                for ingredient_id in self.random.sample(
+                    ingredient_ids, ingredients_per_recipe
+                )
+            ])
+        return ids
+
+    def seed_user_collections(self, model, field, user_ids, target_ids,
+                              per_user):
+        per_user = min(per_user, len(target_ids) - 1)
+        objs = []
+        for user_id in user_ids:
+            for target_id in set(self.random.sample(target_ids, per_user)):
+                if field == 'author_id' and target_id == user_id:
+                    continue
+                objs.append(model(user_id=user_id, **{field: target_id}))
+            if len(objs) >= self.batch_size:
+                self.bulk_create(model, objs)
+                objs = []
+        self.bulk_create(model, objs)
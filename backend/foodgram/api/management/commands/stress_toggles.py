@@ -0,0 +1,113 @@
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Favourite, Recipe, ShoppingCart
+from users.models import Follow
+from .seed_benchmark_data import BENCHMARK_PREFIX
+
+User = get_user_model()
+
+EXPECTED_STATUSES = {201, 204, 400}
+
+
+class Command(BaseCommand):
+    help = (
+        'Sending concurrent add/remove requests for favourites, '
+        'shopping cart and subscriptions and checking that no duplicates '
+        'appear and counters match the data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument(
+            '--threads', type=int, default=4,
+            help='Concurrent clients per user'
+        )
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        users = list(
+            User.objects.filter(username__startswith=BENCHMARK_PREFIX)
+            .order_by('pk')[:options['users'] + 1]
+        )
+        if len(users) < 2:
+            raise CommandError('Run seed_benchmark_data first')
+        author, users = users[0], users[1:]
+        recipe = Recipe.objects.filter(author=author).first()
+        if recipe is None:
+            raise CommandError(f'User {author.pk} has no recipes')
+        urls = (
+            f'/api/recipes/{recipe.pk}/favorite/',
+            f'/api/recipes/{recipe.pk}/shopping_cart/',
+            f'/api/users/{author.pk}/subscribe/',
+        )
+        tokens = [
+            Token.objects.get_or_create(user=user)[0].key for user in users
+        ]
+
+        workers = [
+            (token, random.Random(options['seed'] + number))
+            for token in tokens
+            for number in range(options['threads'])
+        ]
+        barrier = threading.Barrier(len(workers))
+
+        def hammer(token, generator):
+            client = Client(HTTP_AUTHORIZATION=f'Token {token}')
+            statuses = Counter()
+            barrier.wait()
+            try:
+                for _ in range(options['iterations']):
+                    method = generator.choice(('post', 'delete'))
+                    url = generator.choice(urls)
+                    statuses[getattr(client, method)(url).status_code] += 1
+            finally:
+                connection.close()
+            return statuses
+
+        with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+            results = list(executor.map(lambda args: hammer(*args), workers))
+        statuses = sum(results, Counter())
+        self.stdout.write(f'Responses: {dict(sorted(statuses.items()))}')
+
+        errors = []
+        unexpected = set(statuses) - EXPECTED_STATUSES
+        if unexpected:
+            errors.append(f'unexpected statuses {sorted(unexpected)}')
+        for model, field in (
+            (Favourite, 'recipe'), (ShoppingCart, 'recipe'), (Follow, 'author')
+        ):
+            duplicates = model.objects.values('user', field).annotate(
+                rows=Count('id')
+            ).filter(rows__gt=1).count()
+            if duplicates:
+                errors.append(f'{model.__name__}: {duplicates} duplicates')
+        recipe.refresh_from_db()
+        favourites = Favourite.objects.filter(recipe=recipe).count()
+        if recipe.favourites_count != favourites:
+            errors.append(
+                f'favourites_count {recipe.favourites_count} != {favourites}'
+            )
+        author.refresh_from_db()
+        followers = Follow.objects.filter(author=author).count()
+        if author.followers_count != followers:
+            errors.append(
+                f'followers_count {author.followers_count} != {followers}'
+            )
+
+        if errors:
+            raise CommandError('; '.join(errors))
+        self.stdout.write(self.style.SUCCESS(
+            f'{sum(statuses.values())} requests from {len(workers)} clients, '
+            f'no duplicates, counters match'
+        ))
@@ -0,0 +1,212 @@
+"""
+Метрики API в текстовом формате Prometheus без внешних зависимостей.
+Значения хранятся в памяти процесса, поэтому каждый воркер gunicorn
+отдаёт только свои метрики, помеченные меткой worker (pid процесса)
+"""
+import os
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def escape(value):
+    return (
+        str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        f'{name}="{escape(value)}"' for name, value in labels
+    ) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def render(self, base_labels=()):
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.type}',
+        ]
+        for labels, value in self.samples():
+            lines.append(
+                f'{self.name}{format_labels(base_labels + labels)} {value}'
+            )
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield tuple(zip(self.labelnames, labels)), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts, total = self.values.setdefault(
+                labels, ([0] * (len(self.buckets) + 1), [0])
+            )
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def render(self, base_labels=()):
+        with self.lock:
+            values = [
+                (labels, list(counts), total[0])
+                for labels, (counts, total) in self.values.items()
+            ]
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.type}',
+        ]
+        for labels, counts, total in values:
+            labels = base_labels + tuple(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket_labels = format_labels(labels + (('le', bound),))
+                lines.append(
+                    f'{self.name}_bucket{bucket_labels} {cumulative}'
+                )
+            lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+            lines.append(
+                f'{self.name}_count{format_labels(labels)} {cumulative}'
+            )
+        return lines
+
+
+class Gauge(Metric):
+    """Значение читается функцией collect в момент сбора метрик"""
+    type = 'gauge'
+
+    def __init__(self, name, description, collect, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield tuple(zip(self.labelnames, labels)), value
+
+
+class Registry:
+    """
+    Запись значения — пара операций со словарём под блокировкой метрики,
+    поэтому сбор не замедляет обработку запросов заметно
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        base_labels = (('worker', os.getpid()),)
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(base_labels))
+        return '\n'.join(lines) + '\n'
+
+
+def resident_memory():
+    """Текущий RSS процесса по /proc/self/statm (только Linux)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return []
+    return [((), pages * os.sysconf('SC_PAGE_SIZE'))]
+
+
+def image_queue_depth():
+    from recipes.images import image_queue
+
+    return [((), image_queue.depth)]
+
+
+registry = Registry()
+request_duration = registry.register(Histogram(
+    'foodgram_http_request_duration_seconds',
+    'Время обработки запроса к API.',
+    ('view', 'method'),
+))
+request_total = registry.register(Counter(
+    'foodgram_http_requests_total',
+    'Число запросов к API по коду ответа.',
+    ('view', 'method', 'status'),
+))
+request_queries = registry.register(Histogram(
+    'foodgram_db_queries_per_request',
+    'Число SQL-запросов на один запрос к API.',
+    ('view', 'method'),
+    buckets=QUERY_BUCKETS,
+))
+db_duration = registry.register(Counter(
+    'foodgram_db_query_seconds_total',
+    'Суммарное время SQL-запросов.',
+    ('view', 'method'),
+))
+db_connections = registry.register(Counter(
+    'foodgram_db_connections_created_total',
+    'Новые соединения с базой данных.',
+    ('database',),
+))
+cache_requests = registry.register(Counter(
+    'foodgram_cache_requests_total',
+    'Обращения к кэшам справочников и ответов.',
+    ('cache', 'result'),
+))
+registry.register(Gauge(
+    'foodgram_image_queue_depth',
+    'Картинки рецептов, ожидающие обработки.',
+    image_queue_depth,
+))
+registry.register(Gauge(
+    'process_resident_memory_bytes',
+    'Резидентная память процесса.',
+    resident_memory,
+))
+
+
+def observe_request(view_name, method, status, duration, queries, db_time):
+    view_name = view_name or 'unknown'
+    request_duration.observe(duration, view_name, method)
+    request_total.inc(view_name, method, status)
+    request_queries.observe(queries, view_name, method)
+    db_duration.inc(view_name, method, amount=db_time)
+
+
+def observe_cache(name, hit):
+    cache_requests.inc(name, 'hit' if hit else 'miss')
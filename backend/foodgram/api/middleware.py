@@ -0,0 +1,125 @@
+import asyncio
+import json
+import logging
+import time
+
+from django.conf import settings
+
+from .instrumentation import RequestMetrics, current_metrics, record_queries
+from .metrics import observe_request
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def get_query_budget(method, view_name):
+    return settings.QUERY_BUDGETS.get(
+        f'{method} {view_name}', settings.QUERY_BUDGETS.get(view_name)
+    )
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Считает SQL-запросы каждого запроса к API через
+    connection.execute_wrapper и отдаёт метрики в заголовке
+    Server-Timing, в строке лога в формате JSON и в метриках /api/metrics.
+    settings.QUERY_BUDGETS задаёт допустимое число запросов для имени view
+    или для пары 'МЕТОД имя_view', при превышении
+    QUERY_BUDGET_MODE = 'log' пишет предупреждение,
+    а 'raise' выбрасывает QueryBudgetExceeded (для тестов).
+    Запросы, выполненные при отдаче StreamingHttpResponse,
+    происходят после middleware и не учитываются.
+    В режиме ASGI запросы выполняются в потоках view, поэтому учитываются
+    только view, обёрнутые api.async_views.async_view
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Так же Django помечает асинхронные MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with record_queries(metrics):
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.process(
+            request, response, metrics, time.perf_counter() - start
+        )
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.process(
+            request, response, metrics, time.perf_counter() - start
+        )
+
+    def process(self, request, response, metrics, duration):
+        match = request.resolver_match
+        view_name = match.view_name if match else None
+        observe_request(
+            view_name, request.method, response.status_code,
+            duration, metrics.queries, metrics.db_time
+        )
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={metrics.db_time * 1000:.1f};'
+            f'desc="{metrics.queries} queries"',
+            f'serialize;dur={metrics.serializer_time * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ))
+        # Строка на каждый запрос пишется только на уровне DEBUG,
+        # запросы с повторяющимися SQL-запросами — на уровне INFO
+        level = logging.INFO if metrics.duplicates else logging.DEBUG
+        if logger.isEnabledFor(level):
+            self.log_request(
+                level, request, response, metrics, duration, view_name
+            )
+
+        budget = get_query_budget(request.method, view_name)
+        if budget is not None and metrics.queries > budget:
+            message = (
+                f'{view_name} ran {metrics.queries} queries, '
+                f'budget is {budget}'
+            )
+            if settings.QUERY_BUDGET_MODE == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    @staticmethod
+    def log_request(level, request, response, metrics, duration, view_name):
+        logger.log(level, json.dumps({
+            'view': view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 2),
+            'serializer_ms': round(metrics.serializer_time * 1000, 2),
+            'duration_ms': round(duration * 1000, 2),
+            'duplicates': [
+                {
+                    'fingerprint': key,
+                    'count': count,
+                    'sql': metrics.examples[key][:200],
+                }
+                for key, count in metrics.duplicates.items()
+            ],
+        }, ensure_ascii=False))
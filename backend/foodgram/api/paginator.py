@@ -1,7 +1,136 @@
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import (
+    Cursor,
+    CursorPagination as DjangoCursorPagination,
     PageNumberPagination as DjangoPageNumberPagination
 )
+from rest_framework.response import Response
 
 
 class PageNumberPagination(DjangoPageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class CursorPagination(DjangoCursorPagination):
+    """
+    Keyset-пагинация по составному ключу, по умолчанию (created, id).
+    Следующая страница выбирается условием по значениям ключа
+    последней записи, поэтому не требует OFFSET и COUNT(*).
+    View может задать свой ключ атрибутом cursor_ordering,
+    последним полем ключа должен быть уникальный id
+    """
+    page_size_query_param = 'limit'
+    ordering = ('-created', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            )
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None and self.cursor.position is not None:
+            queryset = queryset.filter(
+                self.get_seek_filter(
+                    queryset, ordering, self.cursor.position
+                )
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_previous = has_more
+            self.has_next = True
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None and (
+                self.cursor.position is not None
+            )
+        return self.page
+
+    @staticmethod
+    def get_field(queryset, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        model = queryset.model
+        *path, name = name.split('__')
+        for part in path:
+            model = model._meta.get_field(part).related_model
+        return model._meta.get_field(name)
+
+    def get_seek_filter(self, queryset, ordering, position):
+        """
+        Значения из курсора приводятся к типам полей ключа: курсор
+        приходит от клиента, и подделанное значение должно давать 404,
+        а не ошибку базы
+        """
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        seek_filter = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            try:
+                value = self.get_field(queryset, name).to_python(value)
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            seek_filter |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return seek_filter
+
+    def get_position(self, instance):
+        values = []
+        for field in self.ordering:
+            value = instance
+            for attr in field.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        return json.dumps(values, separators=(',', ':'))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=False,
+            position=self.get_position(self.page[-1])
+        ))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=True,
+            position=self.get_position(self.page[0])
+        ))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
@@ -0,0 +1,141 @@
+import csv
+import io
+import json
+import os
+
+from django.conf import settings
+from rest_framework import renderers
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу возвращает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartRenderer(renderers.BaseRenderer):
+    """
+    Базовый класс для выгрузки списка покупок.
+    Содержимое файла отдаётся потоком через stream(),
+    render() используется только для сообщений об ошибках
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = data.get('detail', data)
+        return str(data).encode('utf-8')
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    @property
+    def filename(self):
+        return f'list.{self.format}'
+
+    def stream(self, ingredients):
+        """
+        Принимает итератор кортежей (название, единица измерения, количество)
+        и возвращает итератор частей файла
+        """
+        raise NotImplementedError
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for name, measurement_unit, amount in ingredients:
+            yield f'{name}: {amount} {measurement_unit}\n'
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('name', 'measurement_unit', 'amount'))
+        for ingredient in ingredients:
+            yield writer.writerow(ingredient)
+
+
+class ShoppingCartJSONRenderer(ShoppingCartRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, ingredients):
+        separator = '['
+        for name, measurement_unit, amount in ingredients:
+            yield separator + json.dumps(
+                {
+                    'name': name,
+                    'measurement_unit': measurement_unit,
+                    'amount': amount
+                },
+                ensure_ascii=False
+            )
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+
+
+class ShoppingCartPDFRenderer(ShoppingCartRenderer):
+    """
+    PDF нельзя отдавать по частям, поэтому документ собирается
+    в памяти и отдаётся одним куском
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingCartFont'
+    font_size = 12
+    line_height = 18
+    margin = 50
+
+    def get_font(self):
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        font_path = settings.SHOPPING_CART_PDF_FONT
+        if not os.path.exists(font_path):
+            return 'Helvetica'
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(self.font_name, font_path))
+        return self.font_name
+
+    def stream(self, ingredients):
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+
+        buffer = io.BytesIO()
+        document = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        _, height = A4
+        y = height - self.margin
+        document.setFont(font, self.font_size)
+        for name, measurement_unit, amount in ingredients:
+            if y < self.margin:
+                document.showPage()
+                document.setFont(font, self.font_size)
+                y = height - self.margin
+            document.drawString(
+                self.margin, y, f'{name}: {amount} {measurement_unit}'
+            )
+            y -= self.line_height
+        document.save()
+        yield buffer.getvalue()
+
+
+SHOPPING_CART_RENDERERS = (
+    ShoppingCartTextRenderer,
+    ShoppingCartCSVRenderer,
+    ShoppingCartJSONRenderer,
+    ShoppingCartPDFRenderer,
+)
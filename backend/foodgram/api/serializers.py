@@ -1,19 +1,34 @@
+import json
+import logging
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import QueryDict
 from rest_framework import serializers, validators
 from drf_extra_fields.fields import Base64ImageField
 
+from recipes.images import image_queue
 from recipes.models import Tag, Recipe, Ingredient, IngredientAmount
+from .fields import RecipeImageField
+from .instrumentation import TimedSerializerMixin
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
 
-class SimpleRecipeSerializer(serializers.ModelSerializer):
+class SimpleRecipeSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     is_subscribed = serializers.SerializerMethodField()
 
@@ -29,6 +44,8 @@ class UserSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user_made_request = self.context.get('request').user
         return (
             user_made_request.is_authenticated
@@ -36,11 +53,12 @@ class UserSerializer(serializers.ModelSerializer):
         )
 
 
-class UserWithRecipesSerializer(serializers.ModelSerializer):
+class UserWithRecipesSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
 
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -58,30 +76,34 @@ class UserWithRecipesSerializer(serializers.ModelSerializer):
     def get_is_subscribed(self, obj):
         return True
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+    @staticmethod
+    def get_recipes_limit(request):
+        recipes_limit = request.query_params.get('recipes_limit')
+        if recipes_limit and recipes_limit.isdigit():
+            return int(recipes_limit)
+        return None
 
     def get_recipes(self, obj):
-        recipes = obj.recipes.all()
-        if hasattr(self.context, 'query_params'):
-            recipes_limit = self.context.query_params.get('recipes_limit')
-            if (
-                recipes_limit and recipes_limit.isdigit()
-                and int(recipes_limit) >= 0
-            ):
-                recipes = recipes[:int(recipes_limit)]
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            recipes = obj.recipes.all()
+            if hasattr(self.context, 'query_params'):
+                recipes_limit = self.get_recipes_limit(self.context)
+                if recipes_limit is not None:
+                    recipes = recipes[:recipes_limit]
         return SimpleRecipeSerializer(
             recipes,
             many=True).data
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = '__all__'
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = '__all__'
@@ -118,22 +140,50 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeGetSerializer(serializers.ModelSerializer):
+class RecipeGetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     ingredients = IngredientAmountSerializer(many=True)
     tags = TagSerializer(many=True)
     author = UserSerializer()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
+            'is_in_shopping_cart', 'name', 'image', 'image_srcset',
+            'text', 'cooking_time'
         )
 
+    def get_image_srcset(self, obj):
+        """
+        Наборы ссылок на уменьшенные копии картинки в формате srcset
+        для каждого формата, пустой словарь пока копии не готовы
+        """
+        request = self.context.get('request')
+        srcset = {}
+        for variant in obj.image_variants.values():
+            for file_format in settings.RECIPE_IMAGE_FORMATS:
+                if file_format not in variant:
+                    continue
+                url = default_storage.url(variant[file_format])
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                candidate = f'{url} {variant["width"]}w'
+                candidates = srcset.setdefault(file_format, [])
+                # Маленькие картинки не увеличиваются, копии совпадают
+                if candidate not in candidates:
+                    candidates.append(candidate)
+        return {
+            file_format: ', '.join(candidates)
+            for file_format, candidates in srcset.items()
+        }
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user_made_request = self.context.get('request').user
         return (
             user_made_request.is_authenticated
@@ -141,6 +191,8 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user_made_request = self.context.get('request').user
         return (
             user_made_request.is_authenticated
@@ -148,10 +200,54 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipePostSerializer(serializers.ModelSerializer):
+def get_existing_ids(model, ids):
+    return set(
+        model.objects.filter(id__in=ids).values_list('id', flat=True)
+    )
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """
+    Проверяет существование ингредиентов и тегов сразу для всех рецептов:
+    один запрос id__in на модель, результат передаётся в контексте
+    """
+
+    @staticmethod
+    def collect_ids(values):
+        ids = set()
+        for value in values:
+            try:
+                ids.add(int(value))
+            except (TypeError, ValueError):
+                pass
+        return ids
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            recipes = [item for item in data if isinstance(item, dict)]
+            ingredient_ids = self.collect_ids(
+                ingredient.get('id')
+                for recipe in recipes
+                for ingredient in recipe.get('ingredients') or ()
+                if isinstance(ingredient, dict)
+            )
+            tag_ids = self.collect_ids(
+                tag for recipe in recipes for tag in recipe.get('tags') or ()
+            )
+            self.context['existing_ids'] = {
+                Ingredient: get_existing_ids(Ingredient, ingredient_ids),
+                Tag: get_existing_ids(Tag, tag_ids),
+            }
+        return super().to_internal_value(data)
+
+
+class RecipePostSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     ingredients = IngredientPostSerializer(many=True)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False
+    )
     author = serializers.PrimaryKeyRelatedField(read_only=True)
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
@@ -159,6 +255,33 @@ class RecipePostSerializer(serializers.ModelSerializer):
             'id', 'tags', 'author', 'ingredients',
             'name', 'image', 'text', 'cooking_time'
         )
+        list_serializer_class = RecipeListSerializer
+
+    def to_internal_value(self, data):
+        """
+        В multipart/form-data теги передаются повторяющимся полем tags,
+        а ингредиенты — JSON-строкой в поле ingredients
+        """
+        if isinstance(data, QueryDict):
+            form_data = data.dict()
+            if 'tags' in data:
+                form_data['tags'] = data.getlist('tags')
+            ingredients = form_data.get('ingredients')
+            if isinstance(ingredients, str):
+                try:
+                    form_data['ingredients'] = json.loads(ingredients)
+                except ValueError:
+                    raise serializers.ValidationError({
+                        'ingredients': 'Ингредиенты должны быть JSON-списком'
+                    })
+            data = form_data
+        return super().to_internal_value(data)
+
+    def get_missing_ids(self, model, ids):
+        existing_ids = self.context.get('existing_ids', {}).get(model)
+        if existing_ids is None:
+            existing_ids = get_existing_ids(model, ids)
+        return sorted(set(ids) - existing_ids)
 
     @staticmethod
     def insert_ingredients(ingredients, recipe):
@@ -172,8 +295,7 @@ class RecipePostSerializer(serializers.ModelSerializer):
         ]
         IngredientAmount.objects.bulk_create(ingregients_amounts)
 
-    def validate(self, data):
-        ingredients = data.get('ingredients')
+    def check_ingredients(self, ingredients):
         if not ingredients:
             raise serializers.ValidationError(
                 (
@@ -181,16 +303,15 @@ class RecipePostSerializer(serializers.ModelSerializer):
                     'хотя бы один ингредиент'
                 )
             )
-        if not all(
-            [
-                Ingredient.objects.filter(id=ingredient.get('id'))
-                for ingredient in ingredients
-            ]
-        ):
+        missing_ingredients = self.get_missing_ids(
+            Ingredient, [item['id'] for item in ingredients]
+        )
+        if missing_ingredients:
             raise serializers.ValidationError(
                 (
                     'Вы пытаетесь добавить в рецепт '
-                    'несуществующий ингредиент'
+                    'несуществующие ингредиенты с id: '
+                    + ', '.join(map(str, missing_ingredients))
                 )
             )
 
@@ -212,7 +333,7 @@ class RecipePostSerializer(serializers.ModelSerializer):
                 )
             )
 
-        tags = data.get('tags')
+    def check_tags(self, tags):
         if len(tags) != len(set(tags)):
             raise serializers.ValidationError(
                 (
@@ -221,30 +342,149 @@ class RecipePostSerializer(serializers.ModelSerializer):
                 )
             )
 
+        missing_tags = self.get_missing_ids(Tag, tags)
+        if missing_tags:
+            raise serializers.ValidationError(
+                (
+                    'Вы пытаетесь назначить рецепту '
+                    'несуществующие теги с id: '
+                    + ', '.join(map(str, missing_tags))
+                )
+            )
+
+    def validate(self, data):
+        """
+        При частичном обновлении проверяются только переданные
+        ингредиенты и теги
+        """
+        if not self.partial or 'ingredients' in data:
+            self.check_ingredients(data.get('ingredients'))
+        if not self.partial or 'tags' in data:
+            self.check_tags(data.get('tags'))
         return data
 
+    @staticmethod
+    def process_image(recipe, replaced_variants=None):
+        transaction.on_commit(
+            lambda: image_queue.submit(recipe.id, replaced_variants)
+        )
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.insert_ingredients(ingredients, recipe)
+        self.process_image(recipe)
         return recipe
 
+    @staticmethod
+    def update_ingredients(instance, ingredients):
+        """
+        Изменяет только те строки IngredientAmount, которые отличаются
+        от переданного списка ингредиентов
+        """
+        current = {
+            ingredient_amount.ingredient_id: ingredient_amount
+            for ingredient_amount in instance.ingredients.all()
+        }
+        new = {
+            ingredient.get('id'): ingredient.get('amount')
+            for ingredient in ingredients
+        }
+
+        to_delete = [
+            ingredient_amount.id
+            for ingredient_id, ingredient_amount in current.items()
+            if ingredient_id not in new
+        ]
+        to_update = []
+        for ingredient_id, ingredient_amount in current.items():
+            amount = new.get(ingredient_id)
+            if amount is not None and ingredient_amount.amount != amount:
+                ingredient_amount.amount = amount
+                to_update.append(ingredient_amount)
+        to_create = [
+            IngredientAmount(
+                recipe=instance, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in new.items()
+            if ingredient_id not in current
+        ]
+
+        if to_delete:
+            IngredientAmount.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            IngredientAmount.objects.bulk_update(to_update, ('amount',))
+        if to_create:
+            IngredientAmount.objects.bulk_create(to_create)
+        return {
+            'deleted': len(to_delete),
+            'updated': len(to_update),
+            'created': len(to_create)
+        }
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.set(validated_data.get('tags', instance.tags))
-        ingredients = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        touched = {'tags': 0}
+
+        if tags is not None:
+            current_tags = {tag.id for tag in instance.tags.all()}
+            if current_tags != set(tags):
+                instance.tags.set(tags)
+                touched['tags'] = len(current_tags ^ set(tags))
 
         if ingredients:
-            instance.ingredients.get_queryset().delete()
-            self.insert_ingredients(ingredients, instance)
+            touched.update(self.update_ingredients(instance, ingredients))
 
+        logger.debug(
+            'Recipe %s updated, rows touched: %s', instance.id, touched
+        )
+        if 'image' in validated_data:
+            replaced_variants = instance.image_variants
+            instance.image_variants = {}
+            self.process_image(instance, replaced_variants)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            (instance,),
+            Prefetch(
+                'ingredients',
+                queryset=IngredientAmount.objects.select_related('ingredient')
+            ),
+            'tags'
+        )
         return RecipeGetSerializer(
             instance,
             context={
                 'request': self.context.get('request')
             }
         ).data
+
+
+class IdListSerializer(serializers.Serializer):
+    """
+    Список id для пакетного добавления и удаления.
+    В context передаётся модель, объекты которой перечислены
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_ACTION_MAX_IDS
+    )
+
+    def validate_ids(self, ids):
+        ids = list(dict.fromkeys(ids))
+        model = self.context['model']
+        missing_ids = sorted(set(ids) - get_existing_ids(model, ids))
+        if missing_ids:
+            raise serializers.ValidationError(
+                f'{model._meta.verbose_name_plural} с id '
+                + ', '.join(map(str, missing_ids))
+                + ' не найдены'
+            )
+        return ids
@@ -0,0 +1,74 @@
+from django.contrib.auth import get_user_model
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import Tag, Ingredient, Recipe, IngredientAmount
+from .cache import ingredients_cache, tags_cache, recipes_cache
+from .metrics import db_connections
+
+User = get_user_model()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients_cache(**kwargs):
+    ingredients_cache.invalidate()
+    transaction.on_commit(recipes_cache.invalidate)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags_cache(**kwargs):
+    tags_cache.invalidate()
+    transaction.on_commit(recipes_cache.invalidate)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientAmount)
+@receiver(post_delete, sender=User)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes_cache(**kwargs):
+    transaction.on_commit(recipes_cache.invalidate)
+
+
+# Поля автора, которые попадают в ответы ленты рецептов
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=User)
+def invalidate_recipes_cache_on_author_change(created, update_fields,
+                                              **kwargs):
+    """
+    У нового пользователя ещё нет рецептов, а вход в систему сохраняет
+    только last_login, поэтому кэш сбрасывается, лишь когда могли
+    измениться поля автора в ответах
+    """
+    if created:
+        return
+    if update_fields is None or AUTHOR_FIELDS & set(update_fields):
+        transaction.on_commit(recipes_cache.invalidate)
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    """
+    Закрывает постоянные соединения, которые перестали отвечать,
+    например после перезапуска базы или PgBouncer, чтобы запрос
+    открыл новое вместо ошибки. Аналог CONN_HEALTH_CHECKS из Django 4.1,
+    выполняется после close_old_connections, который закрывает
+    соединения старше CONN_MAX_AGE
+    """
+    for connection in connections.all():
+        if (
+            connection.connection is not None
+            and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+            and not connection.in_atomic_block
+            and not connection.is_usable()
+        ):
+            connection.close()
+
+
+@receiver(connection_created)
+def count_connection(connection, **kwargs):
+    db_connections.inc(connection.alias)
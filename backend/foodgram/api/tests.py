@@ -0,0 +1,1238 @@
+import asyncio
+import base64
+import csv
+import io
+import json
+import shutil
+import os
+import tempfile
+import threading
+from collections import Counter
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipIf
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from recipes.management.commands._streaming import iter_json_array
+from recipes.models import (
+    Favourite, Ingredient, IngredientAmount, Recipe, RecipeScore,
+    ShoppingCart, Tag
+)
+from users.models import Follow
+from .async_views import async_patterns
+from .management.commands.check_query_plans import (
+    Command as CheckQueryPlansCommand
+)
+from .metrics import Histogram
+from .signals import check_connections
+from .urls import router
+
+User = get_user_model()
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+CACHED_RESPONSES = {
+    **TEST_CACHES,
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'test-responses',
+    },
+}
+
+
+def create_user(username, **fields):
+    return User.objects.create_user(
+        email=f'{username}@example.com', username=username,
+        first_name='Иван', last_name='Иванов', password='pass-word-42',
+        **fields
+    )
+
+
+def make_image(color='blue', size=(60, 40), file_format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, file_format)
+    return buffer.getvalue()
+
+
+def as_base64(content):
+    return 'data:image/png;base64,' + base64.b64encode(content).decode()
+
+
+def create_recipe(author, name='Рецепт', **fields):
+    return Recipe.objects.create(
+        author=author, name=name, text='Описание',
+        image='recipes/images/test.png', cooking_time=10, **fields
+    )
+
+
+@override_settings(
+    CACHES=TEST_CACHES, IMAGE_PROCESSING_EXECUTOR='sync',
+    QUERY_BUDGET_MODE='raise'
+)
+class RecipeQueryCountTests(APITestCase):
+    """
+    Число SQL-запросов ленты и рецепта не должно зависеть от числа
+    рецептов, тегов и ингредиентов на странице
+    """
+    LIST_QUERIES = 5
+    LIST_QUERIES_AUTHENTICATED = 6
+    DETAIL_QUERIES = 4
+    DETAIL_QUERIES_AUTHENTICATED = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Иван', last_name='Иванов', password='pass-word-42'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        authors = [
+            User.objects.create_user(
+                email=f'author{number}@example.com',
+                username=f'author{number}',
+                first_name='Автор', last_name=str(number),
+                password='pass-word-42'
+            )
+            for number in range(3)
+        ]
+        tags = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ('Завтрак', '#e26c2d', 'breakfast'),
+                ('Обед', '#49b64e', 'lunch'),
+            )
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(4)
+        ]
+        for number in range(12):
+            recipe = Recipe.objects.create(
+                author=authors[number % len(authors)],
+                name=f'Рецепт {number}', text='Описание',
+                image='recipes/images/test.png', cooking_time=10
+            )
+            recipe.tags.set(tags)
+            IngredientAmount.objects.bulk_create(
+                IngredientAmount(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1
+                )
+                for ingredient in ingredients
+            )
+        cls.recipe = recipe
+        Favourite.objects.create(user=cls.user, recipe=recipe)
+        ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, author=authors[0])
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def authenticate(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_list_anonymous(self):
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get('/api/recipes/?limit=50')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 12)
+
+    def test_list_does_not_grow_with_page(self):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Новый', password='pass-word-42'
+        )
+        for recipe in Recipe.objects.all():
+            recipe.pk = None
+            recipe.author = author
+            recipe.save()
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get('/api/recipes/?limit=50')
+        self.assertEqual(len(response.data['results']), 24)
+
+    def test_list_authenticated(self):
+        self.authenticate()
+        with self.assertNumQueries(self.LIST_QUERIES_AUTHENTICATED):
+            response = self.client.get('/api/recipes/?limit=50')
+        self.assertEqual(response.status_code, 200)
+        favourites = [
+            recipe['id'] for recipe in response.data['results']
+            if recipe['is_favorited']
+        ]
+        self.assertEqual(favourites, [self.recipe.id])
+
+    def test_detail_anonymous(self):
+        with self.assertNumQueries(self.DETAIL_QUERIES):
+            response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 4)
+
+    def test_detail_authenticated(self):
+        self.authenticate()
+        with self.assertNumQueries(self.DETAIL_QUERIES_AUTHENTICATED):
+            response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_in_shopping_cart'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeCursorPaginationTests(APITestCase):
+    """Курсорная пагинация ленты, включаемая параметром cursor"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.recipes = [
+            create_recipe(author, f'Рецепт {number}') for number in range(5)
+        ]
+        # Одинаковое время создания: порядок задаёт id
+        Recipe.objects.filter(
+            id__in=[recipe.id for recipe in cls.recipes[1:4]]
+        ).update(created=cls.recipes[0].created)
+        for score, recipe in enumerate(cls.recipes):
+            RecipeScore.objects.filter(recipe=recipe).update(popular=score)
+
+    def walk(self, url):
+        ids = []
+        responses = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            responses.append(response)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        return ids, responses
+
+    def test_pages_follow_created_and_id(self):
+        ids, responses = self.walk('/api/recipes/?cursor=&limit=2')
+        expected = list(
+            Recipe.objects.order_by('-created', '-id')
+            .values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(responses), 3)
+        self.assertNotIn('count', responses[0].data)
+        self.assertIsNone(responses[0].data['previous'])
+
+    def test_previous_page(self):
+        _, responses = self.walk('/api/recipes/?cursor=&limit=2')
+        previous = self.client.get(responses[1].data['previous'])
+        self.assertEqual(
+            previous.data['results'], responses[0].data['results']
+        )
+
+    def test_popular_ordering(self):
+        ids, _ = self.walk('/api/recipes/?cursor=&limit=2&ordering=popular')
+        self.assertEqual(
+            ids, [recipe.id for recipe in reversed(self.recipes)]
+        )
+
+    def test_tampered_cursor(self):
+        for position in ('["x",1]', '[1]', 'oops', '[null,1]'):
+            cursor = base64.b64encode(f'p={position}'.encode()).decode()
+            response = self.client.get('/api/recipes/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, position)
+
+
+@override_settings(CACHES=CACHED_RESPONSES, IMAGE_PROCESSING_EXECUTOR='sync')
+class RecipeResponseCacheTests(APITestCase):
+    """Кэш ответов ленты и рецепта для анонимных пользователей"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.recipes = [
+            create_recipe(cls.author, f'Рецепт {number}')
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['responses'].clear()
+
+    def test_cursor_and_page_number_are_cached_separately(self):
+        pages = self.client.get('/api/recipes/')
+        cursor = self.client.get('/api/recipes/?cursor=')
+        self.assertIn('count', pages.data)
+        self.assertNotIn('count', cursor.data)
+        self.assertIn('count', self.client.get('/api/recipes/').data)
+        self.assertNotIn(
+            'count', self.client.get('/api/recipes/?cursor=').data
+        )
+
+    def test_anonymous_list_is_served_from_cache(self):
+        first = self.client.get('/api/recipes/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/recipes/')
+        self.assertEqual(second.data, first.data)
+
+    def test_detail_is_cached(self):
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.client.get('/api/recipes/')
+        reader = create_user('reader')
+        Favourite.objects.create(user=reader, recipe=self.recipes[0])
+        self.client.force_authenticate(reader)
+        favourites = [
+            recipe['id']
+            for recipe in self.client.get('/api/recipes/').data['results']
+            if recipe['is_favorited']
+        ]
+        self.assertEqual(favourites, [self.recipes[0].id])
+
+    def test_recipe_change_invalidates(self):
+        self.client.get('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_recipe(self.author, 'Новый рецепт')
+        self.assertEqual(self.client.get('/api/recipes/').data['count'], 4)
+
+    def test_author_change_invalidates(self):
+        self.client.get('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Пётр'
+            self.author.save(update_fields=('first_name',))
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(
+            response.data['results'][0]['author']['first_name'], 'Пётр'
+        )
+
+    def test_login_keeps_cache(self):
+        self.client.get('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/login/', {
+                'email': 'author@example.com', 'password': 'pass-word-42'
+            })
+        self.assertEqual(response.status_code, 200, response.data)
+        self.client.credentials()
+        with self.assertNumQueries(0):
+            self.client.get('/api/recipes/')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShoppingCartDownloadTests(APITestCase):
+    """Выгрузка списка покупок в разных форматах и её ETag"""
+    URL = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        milk = Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        for amounts in ((cls.flour, 100), (milk, 200)), ((cls.flour, 50),):
+            recipe = create_recipe(cls.user)
+            for ingredient, amount in amounts:
+                IngredientAmount.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=amount
+                )
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def download(self, file_format='txt', **headers):
+        return self.client.get(self.URL, {'format': file_format}, **headers)
+
+    @staticmethod
+    def read(response):
+        return b''.join(response.streaming_content)
+
+    def test_formats(self):
+        self.assertEqual(
+            self.read(self.download('txt')).decode(),
+            'молоко: 200 мл\nмука: 150 г\n'
+        )
+        rows = list(csv.reader(
+            self.read(self.download('csv')).decode().splitlines()
+        ))
+        self.assertEqual(rows, [
+            ['name', 'measurement_unit', 'amount'],
+            ['молоко', 'мл', '200'],
+            ['мука', 'г', '150'],
+        ])
+        self.assertEqual(json.loads(self.read(self.download('json'))), [
+            {'name': 'молоко', 'measurement_unit': 'мл', 'amount': 200},
+            {'name': 'мука', 'measurement_unit': 'г', 'amount': 150},
+        ])
+        response = self.download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(self.read(response).startswith(b'%PDF'))
+
+    def test_empty_cart(self):
+        ShoppingCart.objects.filter(user=self.user).delete()
+        self.assertEqual(json.loads(self.read(self.download('json'))), [])
+
+    def test_not_modified(self):
+        etag = self.download()['ETag']
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.download('csv')['ETag'], etag)
+
+    def test_etag_changes_with_cart(self):
+        etag = self.download()['ETag']
+        IngredientAmount.objects.filter(ingredient=self.flour).update(
+            amount=1
+        )
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_changes_when_ingredient_renamed(self):
+        etag = self.download()['ETag']
+        self.flour.name = 'мука пшеничная'
+        self.flour.measurement_unit = 'кг'
+        self.flour.save()
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('мука пшеничная: 150 кг', self.read(response).decode())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ToggleTests(APITestCase):
+    """Добавление и удаление избранного, списка покупок и подписок"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('author')
+        cls.recipe = create_recipe(cls.author)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_repeated_favorite_reads_recipe_once(self):
+        url = f'/api/recipes/{self.recipe.id}/favorite/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('уже добавлен в Избранное', response.data['errors'])
+        recipe_reads = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('SELECT')
+            and 'FROM "recipes_recipe"' in query['sql']
+        ]
+        self.assertEqual(len(recipe_reads), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favourites_count, 1)
+
+    def test_remove_missing_relation(self):
+        response = self.client.delete(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('не находился в списке покупок', response.data['errors'])
+        response = self.client.delete('/api/recipes/0/shopping_cart/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['is_subscribed'])
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+
+    def test_subscribe_to_self(self):
+        response = self.client.post(f'/api/users/{self.user.id}/subscribe/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['errors'], 'Нельзя подписаться на самого себя'
+        )
+        self.assertFalse(Follow.objects.exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BulkActionTests(APITestCase):
+    """Пакетное добавление и удаление избранного, покупок и подписок"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.authors = [create_user(f'author{number}') for number in range(3)]
+        cls.recipes = [create_recipe(author) for author in cls.authors]
+        cls.ids = [recipe.id for recipe in cls.recipes]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def favourites_counts(self):
+        return list(
+            Recipe.objects.order_by('id')
+            .values_list('favourites_count', flat=True)
+        )
+
+    def test_favorite_add_and_remove(self):
+        url = '/api/recipes/favorite/'
+        response = self.client.post(
+            url, {'ids': self.ids[:2]}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'added': self.ids[:2]})
+        response = self.client.post(
+            url, {'ids': self.ids[1:]}, format='json'
+        )
+        self.assertEqual(response.data, {'added': self.ids[2:]})
+        self.assertEqual(self.favourites_counts(), [1, 1, 1])
+
+        response = self.client.delete(
+            url, {'ids': [self.ids[0], self.ids[2]]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data, {'removed': [self.ids[0], self.ids[2]]}
+        )
+        self.assertEqual(self.favourites_counts(), [0, 1, 0])
+
+    def test_missing_ids_are_rejected(self):
+        response = self.client.post(
+            '/api/recipes/favorite/', {'ids': [self.ids[0], 0, 10 ** 6]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Favourite.objects.exists())
+
+    def test_too_many_ids(self):
+        ids = list(range(1, settings.BULK_ACTION_MAX_IDS + 2))
+        response = self.client.post(
+            '/api/recipes/shopping_cart/', {'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ids', response.data)
+
+    def test_shopping_cart_clear(self):
+        url = '/api/recipes/shopping_cart/'
+        self.client.post(url, {'ids': self.ids}, format='json')
+        for body in ({}, []):
+            response = self.client.delete(url, body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertEqual(ShoppingCart.objects.count(), 3)
+        response = self.client.delete(url)
+        self.assertEqual(response.data, {'removed': self.ids})
+        self.assertFalse(ShoppingCart.objects.exists())
+
+    def test_subscribe(self):
+        url = '/api/users/subscribe/'
+        author_ids = [author.id for author in self.authors]
+        response = self.client.post(
+            url, {'ids': [*author_ids, self.user.id]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Follow.objects.exists())
+
+        response = self.client.post(url, {'ids': author_ids}, format='json')
+        self.assertEqual(response.data, {'added': author_ids})
+        response = self.client.delete(
+            url, {'ids': author_ids[:1]}, format='json'
+        )
+        self.assertEqual(response.data, {'removed': author_ids[:1]})
+        self.assertEqual(
+            list(
+                User.objects.filter(id__in=author_ids).order_by('id')
+                .values_list('followers_count', flat=True)
+            ),
+            [0, 1, 1]
+        )
+
+
+@override_settings(CACHES=TEST_CACHES, IMAGE_PROCESSING_EXECUTOR='sync')
+class RecipeUpdateTests(APITestCase):
+    """Обновление рецепта меняет только отличающиеся строки"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.breakfast, cls.lunch = (
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ('Завтрак', '#e26c2d', 'breakfast'),
+                ('Обед', '#49b64e', 'lunch'),
+            )
+        )
+        cls.flour, cls.milk = (
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (('мука', 'г'), ('молоко', 'мл'))
+        )
+        cls.recipe = create_recipe(cls.author)
+        cls.recipe.tags.set((cls.breakfast,))
+        for ingredient in (cls.flour, cls.milk):
+            IngredientAmount.objects.create(
+                recipe=cls.recipe, ingredient=ingredient, amount=100
+            )
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def patch(self, data):
+        with self.assertLogs('api.serializers', 'DEBUG') as logs:
+            response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response, logs.output[-1]
+
+    def test_patch_without_tags_and_ingredients(self):
+        response, log = self.patch({'name': 'Новое название'})
+        self.assertEqual(response.data['name'], 'Новое название')
+        self.assertIn("rows touched: {'tags': 0}", log)
+        self.assertEqual(len(response.data['tags']), 1)
+        self.assertEqual(len(response.data['ingredients']), 2)
+
+    def test_patch_tags_only(self):
+        _, log = self.patch({'tags': [self.breakfast.id, self.lunch.id]})
+        self.assertIn("rows touched: {'tags': 1}", log)
+        self.assertEqual(IngredientAmount.objects.count(), 2)
+
+    def test_patch_changed_ingredient_only(self):
+        ids = set(IngredientAmount.objects.values_list('id', flat=True))
+        _, log = self.patch({'ingredients': [
+            {'id': self.flour.id, 'amount': 100},
+            {'id': self.milk.id, 'amount': 250},
+        ]})
+        self.assertIn("'deleted': 0, 'updated': 1, 'created': 0", log)
+        self.assertEqual(
+            set(IngredientAmount.objects.values_list('id', flat=True)), ids
+        )
+
+    def test_patch_validates_passed_tags(self):
+        response = self.client.patch(
+            self.url, {'tags': [self.lunch.id, self.lunch.id]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES, IMAGE_PROCESSING_EXECUTOR='sync')
+class RecipeImageTests(APITestCase):
+    """Загрузка картинок рецептов и их уменьшенные копии"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.recipe = create_recipe(cls.author)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.client.force_authenticate(self.author)
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def patch_image(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                self.url, {'image': image}, format='json'
+            )
+        self.recipe.refresh_from_db()
+        return response
+
+    def variant_paths(self):
+        return {
+            variant[file_format]
+            for variant in self.recipe.image_variants.values()
+            for file_format in ('webp', 'jpeg')
+        }
+
+    def test_variants_are_built(self):
+        response = self.patch_image(as_base64(make_image()))
+        self.assertEqual(response.status_code, 200, response.data)
+        paths = self.variant_paths()
+        self.assertTrue(paths)
+        self.assertTrue(all(default_storage.exists(path) for path in paths))
+
+    def test_same_image_keeps_variants(self):
+        image = as_base64(make_image())
+        self.patch_image(image)
+        paths = self.variant_paths()
+        self.patch_image(image)
+        self.assertEqual(self.variant_paths(), paths)
+        self.assertTrue(all(default_storage.exists(path) for path in paths))
+
+    def test_replaced_variants_are_deleted(self):
+        self.patch_image(as_base64(make_image('blue')))
+        old_paths = self.variant_paths()
+        self.patch_image(as_base64(make_image('green')))
+        self.assertFalse(old_paths & self.variant_paths())
+        self.assertFalse(
+            any(default_storage.exists(path) for path in old_paths)
+        )
+
+    def test_shared_variants_are_kept(self):
+        image = as_base64(make_image('blue'))
+        self.patch_image(image)
+        paths = self.variant_paths()
+        other = create_recipe(self.author, image_variants=(
+            self.recipe.image_variants
+        ))
+        self.patch_image(as_base64(make_image('green')))
+        self.assertTrue(all(default_storage.exists(path) for path in paths))
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertFalse(any(default_storage.exists(path) for path in paths))
+
+    def test_multipart_upload(self):
+        image = SimpleUploadedFile('photo.png', make_image(), 'image/png')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                self.url, {'image': image}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.variant_paths())
+
+    @override_settings(FILE_UPLOAD_MAX_SIZE=100)
+    def test_oversized_base64(self):
+        response = self.patch_image(as_base64(make_image(size=(200, 200))))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(
+            'не должен превышать 100 байт', response.data['image'][0]
+        )
+
+    @override_settings(FILE_UPLOAD_MAX_SIZE=100)
+    def test_oversized_multipart(self):
+        image = SimpleUploadedFile(
+            'photo.png', make_image(size=(200, 200)), 'image/png'
+        )
+        response = self.client.patch(
+            self.url, {'image': image}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(
+            'не должен превышать 100 байт', response.data['image'][0]
+        )
+
+    @override_settings(RECIPE_IMAGE_MAX_DIMENSION=50)
+    def test_too_big_dimensions(self):
+        response = self.patch_image(as_base64(make_image(size=(60, 40))))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('не должны превышать 50', response.data['image'][0])
+
+    def test_not_an_image(self):
+        response = self.patch_image(as_base64(b'not an image at all'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.recipe.image_variants, {})
+
+
+@override_settings(CACHES=TEST_CACHES, METRICS_TOKEN='')
+class MetricsTests(APITestCase):
+    """Метрики в текстовом формате Prometheus на /api/metrics"""
+
+    def metrics(self, **headers):
+        response = self.client.get('/api/metrics', **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    @staticmethod
+    def sample(text, name, **labels):
+        """Значение метрики name с метками labels, 0 если её нет"""
+        for line in text.splitlines():
+            metric, _, value = line.rpartition(' ')
+            if not metric.startswith(name + '{'):
+                continue
+            if all(f'{key}="{label}"' in metric
+                   for key, label in labels.items()):
+                return float(value)
+        return 0
+
+    def test_requests_are_counted(self):
+        labels = {'view': 'api:tags-list', 'method': 'GET', 'status': '200'}
+        before = self.sample(
+            self.metrics(), 'foodgram_http_requests_total', **labels
+        )
+        self.client.get('/api/tags/')
+        self.client.get('/api/tags/')
+        text = self.metrics()
+        self.assertEqual(
+            self.sample(text, 'foodgram_http_requests_total', **labels),
+            before + 2
+        )
+        self.assertIn(f'worker="{os.getpid()}"', text)
+        self.assertIn('# TYPE foodgram_http_request_duration_seconds '
+                      'histogram', text)
+
+    def test_catalogue_cache_hits(self):
+        caches['default'].clear()
+        text = self.metrics()
+        hits = self.sample(
+            text, 'foodgram_cache_requests_total', cache='tags', result='hit'
+        )
+        self.client.get('/api/tags/')
+        self.client.get('/api/tags/')
+        self.assertEqual(
+            self.sample(
+                self.metrics(), 'foodgram_cache_requests_total',
+                cache='tags', result='hit'
+            ),
+            hits + 1
+        )
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(
+            '/api/metrics', HTTP_AUTHORIZATION='Bearer wrong'
+        )
+        self.assertEqual(response.status_code, 403)
+        self.metrics(HTTP_AUTHORIZATION='Bearer secret')
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Тест.', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value)
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count 4', lines)
+
+
+class CommandTestMixin:
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.directory = directory
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    @staticmethod
+    def call(*args, **options):
+        stdout = io.StringIO()
+        call_command(*args, stdout=stdout, stderr=io.StringIO(), **options)
+        return stdout.getvalue()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LoadDataTests(CommandTestMixin, TestCase):
+    """Идемпотентная загрузка ингредиентов из JSON, NDJSON и CSV"""
+    INGREDIENTS = [
+        {'name': 'мука', 'measurement_unit': 'г'},
+        {'name': 'молоко', 'measurement_unit': 'мл'},
+        {'name': 'мука', 'measurement_unit': 'г'},
+        {'name': ' соль ', 'measurement_unit': 'щепотка'},
+    ]
+
+    def ingredients(self):
+        return set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+
+    def test_formats(self):
+        expected = {('мука', 'г'), ('молоко', 'мл'), ('соль', 'щепотка')}
+        files = {
+            'json': json.dumps(self.INGREDIENTS, ensure_ascii=False),
+            'ndjson': '\n'.join(
+                json.dumps(item, ensure_ascii=False)
+                for item in self.INGREDIENTS
+            ),
+            'csv': ''.join(
+                f'{item["name"]},{item["measurement_unit"]}\n'
+                for item in self.INGREDIENTS
+            ),
+        }
+        for file_format, content in files.items():
+            Ingredient.objects.all().delete()
+            path = self.write(f'ingredients.{file_format}', content)
+            output = self.call('load_data', path=path, batch_size=2)
+            self.assertIn('read 4, added 3, unchanged 1', output)
+            self.assertEqual(self.ingredients(), expected, file_format)
+
+    def test_repeated_load_adds_nothing(self):
+        Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        path = self.write(
+            'ingredients.json',
+            json.dumps(self.INGREDIENTS, ensure_ascii=False)
+        )
+        self.assertIn('added 2', self.call('load_data', path=path))
+        self.assertIn('added 0', self.call('load_data', path=path))
+        self.assertEqual(Ingredient.objects.count(), 3)
+
+    def test_dry_run(self):
+        path = self.write(
+            'ingredients.json',
+            json.dumps(self.INGREDIENTS, ensure_ascii=False)
+        )
+        output = self.call('load_data', path=path, dry_run=True)
+        self.assertIn('+ молоко (мл)', output)
+        self.assertIn('would add 3', output)
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_invalid_record(self):
+        path = self.write('ingredients.ndjson', '{"name": "мука"}\n')
+        with self.assertRaises(CommandError):
+            self.call('load_data', path=path)
+
+    def test_json_items_across_buffers(self):
+        items = [{'name': 'x' * number, 'amount': 10 ** number}
+                 for number in range(1, 8)]
+        self.assertEqual(
+            list(iter_json_array(io.StringIO(json.dumps(items)), 5)), items
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeImportExportTests(CommandTestMixin, TestCase):
+    """Экспорт и импорт рецептов с продолжением по контрольной точке"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#e26c2d', slug='breakfast'
+        )
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        for number in range(3):
+            recipe = create_recipe(cls.author, f'Рецепт {number}')
+            recipe.tags.set((cls.tag,))
+            IngredientAmount.objects.create(
+                recipe=recipe, ingredient=cls.flour, amount=number + 1
+            )
+
+    @staticmethod
+    def snapshot():
+        return [
+            (
+                recipe.id, recipe.author_id, recipe.created, recipe.name,
+                [tag.id for tag in recipe.tags.all()],
+                [(item.ingredient_id, item.amount)
+                 for item in recipe.ingredients.all()],
+            )
+            for recipe in Recipe.objects.order_by('id')
+        ]
+
+    def export(self, file_format):
+        path = os.path.join(self.directory, f'recipes.{file_format}')
+        self.call('export_recipes', path)
+        return path
+
+    def test_round_trip(self):
+        expected = self.snapshot()
+        for file_format in ('ndjson', 'csv'):
+            path = self.export(file_format)
+            Recipe.objects.all().delete()
+            output = self.call('import_recipes', path, chunk_size=2)
+            self.assertIn('Recipes imported: 3', output)
+            self.assertEqual(self.snapshot(), expected, file_format)
+            self.author.refresh_from_db()
+            self.assertEqual(self.author.recipes_count, 3)
+
+    def test_repeated_import_skips_present_recipes(self):
+        path = self.export('ndjson')
+        self.assertIn('Recipes imported: 0', self.call('import_recipes', path))
+        self.assertEqual(Recipe.objects.count(), 3)
+
+    def test_unknown_references_are_skipped(self):
+        path = self.export('ndjson')
+        Recipe.objects.all().delete()
+        self.flour.delete()
+        output = self.call('import_recipes', path)
+        self.assertIn('Skipped 3 records', output)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_resume_from_checkpoint(self):
+        path = self.export('ndjson')
+        with open(path, encoding='utf-8') as file:
+            lines = file.readlines()
+        Recipe.objects.all().delete()
+        checkpoint = os.path.join(self.directory, 'import.checkpoint')
+
+        # Третья запись испорчена: две первые пачки уже закоммичены
+        broken = self.write('recipes.ndjson', ''.join(lines[:2]) + '{}\n')
+        with self.assertRaises(CommandError):
+            self.call(
+                'import_recipes', broken, chunk_size=1, checkpoint=checkpoint
+            )
+        self.assertEqual(Recipe.objects.count(), 2)
+
+        self.write('recipes.ndjson', ''.join(lines))
+        output = self.call(
+            'import_recipes', broken, chunk_size=1, checkpoint=checkpoint
+        )
+        self.assertIn('Resuming after 2 records', output)
+        self.assertIn('Recipes imported: 1', output)
+        self.assertEqual(Recipe.objects.count(), 3)
+
+    def test_checkpoint_of_other_file(self):
+        checkpoint = self.write('import.checkpoint', json.dumps(
+            {'source': '/elsewhere.ndjson', 'processed': 1}
+        ))
+        with self.assertRaises(CommandError):
+            self.call(
+                'import_recipes', self.export('ndjson'), checkpoint=checkpoint
+            )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class QueryPlanTests(CommandTestMixin, TestCase):
+    """Индексы, которые check_query_plans ожидает увидеть в планах"""
+    POSTGRESQL_ONLY = {
+        'ingredient_name_trgm_idx', 'ingredient_amount_cover_idx'
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('bench1')
+        cls.author = create_user('bench2')
+        recipe = create_recipe(cls.author)
+        IngredientAmount.objects.create(
+            recipe=recipe, amount=1,
+            ingredient=Ingredient.objects.create(
+                name='мука', measurement_unit='г'
+            )
+        )
+        ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def test_expected_indexes_exist(self):
+        checks = CheckQueryPlansCommand().get_checks(self.user, self.author)
+        expected = {
+            index for _, _, indexes in checks for index in indexes
+        } - self.POSTGRESQL_ONLY
+        with connection.cursor() as cursor:
+            existing = {
+                name
+                for table in connection.introspection.table_names(cursor)
+                for name in connection.introspection.get_constraints(
+                    cursor, table
+                )
+            }
+        self.assertEqual(expected - existing, set())
+
+    def test_plans_are_captured(self):
+        path = os.path.join(self.directory, 'plans.json')
+        self.call('check_query_plans', output=path)
+        with open(path, encoding='utf-8') as file:
+            report = json.load(file)
+        checks = CheckQueryPlansCommand().get_checks(self.user, self.author)
+        self.assertEqual(len(report['checks']), len(checks))
+        for check in report['checks']:
+            self.assertTrue(check['plan'], check['name'])
+
+
+class ConnectionHealthCheckTests(SimpleTestCase):
+    """Закрытие сломанных постоянных соединений в начале запроса"""
+
+    def make_connection(self, usable=False, in_atomic_block=False,
+                        health_checks=True):
+        return mock.Mock(
+            connection=object(),
+            settings_dict={'CONN_HEALTH_CHECKS': health_checks},
+            in_atomic_block=in_atomic_block,
+            **{'is_usable.return_value': usable}
+        )
+
+    def check(self, *database_connections):
+        with mock.patch(
+            'api.signals.connections.all',
+            return_value=list(database_connections)
+        ):
+            check_connections()
+
+    def test_unusable_connection_is_closed(self):
+        broken = self.make_connection()
+        alive = self.make_connection(usable=True)
+        self.check(broken, alive)
+        broken.close.assert_called_once_with()
+        alive.close.assert_not_called()
+
+    def test_connection_in_transaction_is_kept(self):
+        database_connection = self.make_connection(in_atomic_block=True)
+        self.check(database_connection)
+        database_connection.is_usable.assert_not_called()
+        database_connection.close.assert_not_called()
+
+    def test_disabled_health_checks_skip_probe(self):
+        database_connection = self.make_connection(health_checks=False)
+        self.check(database_connection)
+        database_connection.is_usable.assert_not_called()
+        database_connection.close.assert_not_called()
+
+    def test_closed_connection_is_not_probed(self):
+        database_connection = self.make_connection()
+        database_connection.connection = None
+        self.check(database_connection)
+        database_connection.is_usable.assert_not_called()
+
+
+@skipIf(
+    connection.vendor == 'sqlite'
+    and not settings.DATABASES['default']['TEST']['NAME'],
+    'SQLite в памяти блокирует таблицы, задайте DB_TEST_NAME'
+)
+@override_settings(CACHES=TEST_CACHES)
+class ConcurrentToggleTests(TransactionTestCase):
+    """
+    Одновременные одинаковые запросы добавления и удаления должны
+    создать не больше одной связи и оставить счётчики верными
+    """
+    THREADS = 8
+
+    def setUp(self):
+        caches['default'].clear()
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='pass-word-42'
+        )
+        self.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Иван', last_name='Иванов', password='pass-word-42'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            image='recipes/images/test.png', cooking_time=10
+        )
+
+    def send_concurrently(self, method, url):
+        barrier = threading.Barrier(self.THREADS)
+
+        def send():
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+            barrier.wait()
+            try:
+                return getattr(client, method)(url).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            futures = [executor.submit(send) for _ in range(self.THREADS)]
+            return Counter(future.result() for future in futures)
+
+    def assert_toggles(self, url, model, counter_object, counter_field,
+                       **relation):
+        statuses = self.send_concurrently('post', url)
+        self.assertEqual(statuses[201], 1, statuses)
+        self.assertEqual(model.objects.filter(**relation).count(), 1)
+        counter_object.refresh_from_db()
+        self.assertEqual(getattr(counter_object, counter_field), 1)
+
+        statuses = self.send_concurrently('delete', url)
+        self.assertEqual(statuses[204], 1, statuses)
+        self.assertFalse(model.objects.filter(**relation).exists())
+        counter_object.refresh_from_db()
+        self.assertEqual(getattr(counter_object, counter_field), 0)
+
+    def test_favorite(self):
+        self.assert_toggles(
+            f'/api/recipes/{self.recipe.id}/favorite/', Favourite,
+            self.recipe, 'favourites_count',
+            user=self.user, recipe=self.recipe
+        )
+
+    def test_shopping_cart(self):
+        url = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        statuses = self.send_concurrently('post', url)
+        self.assertEqual(statuses[201], 1, statuses)
+        self.assertEqual(
+            ShoppingCart.objects.filter(user=self.user).count(), 1
+        )
+        statuses = self.send_concurrently('delete', url)
+        self.assertEqual(statuses[204], 1, statuses)
+        self.assertFalse(ShoppingCart.objects.exists())
+
+    def test_subscribe(self):
+        self.assert_toggles(
+            f'/api/users/{self.author.id}/subscribe/', Follow,
+            self.author, 'followers_count',
+            user=self.user, author=self.author
+        )
+
+
+@override_settings(CACHES=TEST_CACHES, SERVER_MODE='asgi')
+class AsgiStreamingTests(TransactionTestCase):
+    """
+    В режиме ASGI ответ проходит через ASGIHandler целиком, включая
+    чтение потокового содержимого в цикле событий
+    """
+
+    def setUp(self):
+        user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Иван', last_name='Иванов', password='pass-word-42'
+        )
+        self.token = Token.objects.create(user=user)
+        recipe = Recipe.objects.create(
+            author=user, name='Рецепт', text='Описание',
+            image='recipes/images/test.png', cooking_time=10
+        )
+        IngredientAmount.objects.create(
+            recipe=recipe, amount=3,
+            ingredient=Ingredient.objects.create(
+                name='мука', measurement_unit='г'
+            )
+        )
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+
+    def get(self, url):
+        urlconf = type('AsgiUrls', (), {'urlpatterns': [
+            path('api/', include((async_patterns(router.urls), 'api')))
+        ]})
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': url,
+            'query_string': b'', 'server': ('testserver', 80),
+            'headers': [
+                (b'host', b'testserver'),
+                (b'authorization', f'Token {self.token.key}'.encode()),
+            ],
+        }
+        with override_settings(ROOT_URLCONF=urlconf):
+            asyncio.run(ASGIHandler()(scope, receive, send))
+        status_code = messages[0]['status']
+        body = b''.join(
+            message.get('body', b'') for message in messages[1:]
+        )
+        return status_code, body
+
+    def test_download_shopping_cart(self):
+        status_code, body = self.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(status_code, 200, body)
+        self.assertEqual(body.decode(), 'мука: 3 г\n')
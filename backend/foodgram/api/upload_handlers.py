@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """
+    Прерывает приём файла, как только он превысил
+    settings.FILE_UPLOAD_MAX_SIZE, не дожидаясь конца запроса.
+    Имена полей с пропущенными файлами сохраняются
+    в request.oversized_uploads
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.FILE_UPLOAD_MAX_SIZE:
+            oversized_uploads = getattr(self.request, 'oversized_uploads', [])
+            oversized_uploads.append(self.field_name)
+            self.request.oversized_uploads = oversized_uploads
+            raise SkipFile()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
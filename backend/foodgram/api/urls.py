@@ -2,9 +2,10 @@ from django.urls import include, path
 
 from rest_framework.routers import DefaultRouter
 
+from .async_views import async_patterns
 from .views import (
     TagViewSet, RecipeViewSet, IngredientViewSet,
-    SubscribtionsView, SubscribeView
+    SubscribtionsView, SubscribeView, BulkSubscribeView, metrics
 )
 
 app_name = 'api'
@@ -14,10 +15,22 @@ router.register('tags', TagViewSet, basename='tags')
 router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('ingredients', IngredientViewSet, basename='ingredients')
 
-urlpatterns = [
-    path(r'users/<int:id>/subscribe/', SubscribeView.as_view()),
-    path(r'users/subscriptions/', SubscribtionsView.as_view()),
-    path('', include(router.urls)),
+urlpatterns = async_patterns([
+    path(
+        r'users/<int:id>/subscribe/', SubscribeView.as_view(),
+        name='subscribe'
+    ),
+    path(
+        r'users/subscriptions/', SubscribtionsView.as_view(),
+        name='subscriptions'
+    ),
+    path(
+        r'users/subscribe/', BulkSubscribeView.as_view(),
+        name='subscribe-bulk'
+    ),
+    path('metrics', metrics, name='metrics'),
+    *router.urls,
+]) + [
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken'))
 ]
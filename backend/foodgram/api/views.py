@@ -1,10 +1,21 @@
+import hashlib
+import hmac
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import (
+    Exists, OuterRef, Prefetch, Sum, Value
+)
+from django.db.models.fields import BooleanField
+from django.http import (
+    HttpResponse, HttpResponseForbidden, HttpResponseNotModified,
+    StreamingHttpResponse
+)
+from django.utils.http import parse_etags, quote_etag
 
-from rest_framework import status, viewsets, filters, views
+from rest_framework import status, viewsets, views
 from rest_framework.decorators import action
 from rest_framework.permissions import (
     IsAuthenticated, IsAuthenticatedOrReadOnly, SAFE_METHODS
@@ -13,17 +24,23 @@ from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 
 from users.models import Follow
-from recipes.models import Tag, Recipe, Ingredient, Favourite, ShoppingCart
+from recipes.counters import change_counters
+from recipes.models import (
+    Tag, Recipe, Ingredient, IngredientAmount, Favourite, ShoppingCart
+)
 from .serializers import (
     TagSerializer, RecipePostSerializer, RecipeGetSerializer,
     IngredientSerializer, SimpleRecipeSerializer,
-    UserWithRecipesSerializer
+    UserWithRecipesSerializer, IdListSerializer
 )
 from .permissions import (
     IsAdminAuthorOrReadOnly
 )
-from .filters import RecipeFilter
-from .paginator import PageNumberPagination
+from .cache import ingredients_cache, tags_cache, recipes_cache
+from .metrics import registry
+from .filters import IngredientSearchFilter, RecipeFilter
+from .paginator import CursorPagination, PageNumberPagination
+from .renderers import SHOPPING_CART_RENDERERS
 
 
 User = get_user_model()
@@ -66,74 +83,169 @@ class ExtraAction:
             )
         },
     }
+    COUNTERS = {
+        Follow: 'followers_count',
+        Favourite: 'favourites_count',
+    }
 
-    def extra_action(self, request, model, bind_model, id):
-        obj = get_object_or_404(model, id=id)
-        if model == User and obj == request.user:
+    def update_counters(self, model, bind_model, ids, delta):
+        field = self.COUNTERS.get(bind_model)
+        if field is not None:
+            change_counters(model, ids, field, delta)
+
+    def error_response(self, request, bind_model, obj, error):
+        if obj == request.user:
             return Response(
                 {'errors': 'Нельзя подписаться на самого себя'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        return Response(
+            {'errors': self.ERRORS_TEXTS[bind_model][error].format(obj)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    def extra_action(self, request, model, bind_model, id):
+        """
+        Связь добавляется одним INSERT ... ON CONFLICT DO NOTHING
+        и удаляется одним DELETE, поэтому одновременные повторные
+        запросы не создают дублей и не ломают счётчики.
+        POST читает объект до вставки (404 и данные ответа),
+        DELETE — только если удалять было нечего, для текста ошибки
+        """
+        field = 'recipe' if model == Recipe else 'author'
         if request.method == 'POST':
-            if model == Recipe:
-                _, created = bind_model.objects.get_or_create(
-                    recipe=obj, user=request.user
+            obj = get_object_or_404(model, id=id)
+            if model == User and obj == request.user:
+                return self.error_response(
+                    request, bind_model, obj, 'already_exists'
                 )
-            if model == User:
-                _, created = bind_model.objects.get_or_create(
-                    author=obj, user=request.user
+            with transaction.atomic():
+                created = bind_model.objects.add(
+                    user=request.user, **{field: obj}
                 )
-            if created:
-                if model == Recipe:
-                    serializer = SimpleRecipeSerializer(obj)
-                if model == User:
-                    serializer = UserWithRecipesSerializer(
-                        obj, context=request
-                    )
-                return Response(
-                    serializer.data,
-                    status=status.HTTP_201_CREATED
+                if created:
+                    self.update_counters(model, bind_model, [obj.pk], 1)
+            if not created:
+                return self.error_response(
+                    request, bind_model, obj, 'already_exists'
                 )
-            else:
-                return Response(
-                    {'errors': self.ERRORS_TEXTS[
-                        bind_model]['already_exists'].format(obj)},
-                    status=status.HTTP_400_BAD_REQUEST
+            if model == Recipe:
+                serializer = SimpleRecipeSerializer(obj)
+            if model == User:
+                serializer = UserWithRecipesSerializer(
+                    obj, context=request
                 )
+            return Response(
+                serializer.data,
+                status=status.HTTP_201_CREATED
+            )
         if request.method == 'DELETE':
-            try:
-                if model == Recipe:
-                    bind_model.objects.get(
-                        user=request.user, recipe=obj
-                    ).delete()
-                if model == User:
-                    bind_model.objects.get(
-                        user=request.user, author=obj
-                    ).delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            except ObjectDoesNotExist:
-                return Response(
-                    {'errors': self.ERRORS_TEXTS[
-                        bind_model]['not_exists'].format(obj)},
-                    status=status.HTTP_400_BAD_REQUEST
+            with transaction.atomic():
+                deleted = bind_model.objects.remove(
+                    user=request.user, **{f'{field}_id': id}
+                )
+                if deleted:
+                    self.update_counters(model, bind_model, [id], -1)
+            if not deleted:
+                return self.error_response(
+                    request, bind_model, get_object_or_404(model, id=id),
+                    'not_exists'
                 )
-            except Exception as other_exception:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def bulk_extra_action(self, request, model, bind_model):
+        """
+        Пакетное добавление и удаление связей со списком id в теле
+        запроса: один INSERT ... ON CONFLICT DO NOTHING RETURNING или
+        DELETE ... RETURNING и одно обновление счётчиков в транзакции.
+        DELETE совсем без тела очищает список покупок целиком, любое
+        тело, даже пустое {} или [], проверяется как список id
+        """
+        field = 'recipe' if model == Recipe else 'author'
+        clear = (
+            request.method == 'DELETE' and bind_model == ShoppingCart
+            and not request.body
+        )
+        ids = None
+        if not clear:
+            serializer = IdListSerializer(
+                data=request.data, context={'model': model}
+            )
+            serializer.is_valid(raise_exception=True)
+            ids = serializer.validated_data['ids']
+            if model == User and request.user.pk in ids:
                 return Response(
-                    {'errors': str(other_exception)},
+                    {'errors': 'Нельзя подписаться на самого себя'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = bind_model.objects.insert_ignoring_conflicts(
+                    [
+                        bind_model(user=request.user, **{f'{field}_id': id})
+                        for id in ids
+                    ],
+                    field
+                )
+                self.update_counters(model, bind_model, changed, 1)
+            else:
+                relations = bind_model.objects.filter(user=request.user)
+                if ids is not None:
+                    relations = relations.filter(**{f'{field}_id__in': ids})
+                changed = relations.delete_returning(field)
+                self.update_counters(model, bind_model, changed, -1)
+
+        if request.method == 'POST':
+            return Response(
+                {'added': sorted(changed)}, status=status.HTTP_201_CREATED
+            )
+        return Response({'removed': sorted(changed)})
+
+
+class CachedListMixin:
+    """
+    Отдаёт список целиком из кэша справочника в виде готового JSON
+    """
+    list_cache = None
+
+    def use_list_cache(self, request):
+        return True
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_list_cache(request):
+            return super().list(request, *args, **kwargs)
+        return HttpResponse(
+            self.list_cache.get(), content_type='application/json'
+        )
+
 
 class SubscribtionsView(views.APIView):
+    def get_queryset(self):
+        return User.objects.filter(
+            followings__user=self.request.user
+        ).order_by('pk')
+
     def get(self, request):
         paginator = PageNumberPagination()
-        page = paginator.paginate_queryset(
-            User.objects.prefetch_related('recipes').filter(
-                followings__user=self.request.user).order_by('pk'),
-            request
-        )
+        authors = paginator.paginate_queryset(self.get_queryset(), request)
+        author_ids = [author.pk for author in authors]
+        recipes_limit = UserWithRecipesSerializer.get_recipes_limit(request)
+        if recipes_limit is None:
+            recipes = Recipe.objects.filter(author_id__in=author_ids)
+        else:
+            recipes = Recipe.objects.latest_by_author(
+                author_ids, recipes_limit
+            )
+
+        recipes_by_author = {author_id: [] for author_id in author_ids}
+        for recipe in recipes:
+            recipes_by_author[recipe.author_id].append(recipe)
+        for author in authors:
+            author.latest_recipes = recipes_by_author[author.pk]
+
         serializer = UserWithRecipesSerializer(
-            page, many=True, context=request
+            authors, many=True, context=request
         )
         return paginator.get_paginated_response(serializer.data)
 
@@ -146,8 +258,17 @@ class SubscribeView(views.APIView, ExtraAction):
         return self.extra_action(request, User, Follow, id)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class BulkSubscribeView(views.APIView, ExtraAction):
+    def post(self, request):
+        return self.bulk_extra_action(request, User, Follow)
+
+    def delete(self, request):
+        return self.bulk_extra_action(request, User, Follow)
+
+
+class TagViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.order_by('pk')
+    list_cache = tags_cache
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = (IsAuthenticatedOrReadOnly,)
@@ -157,18 +278,80 @@ class RecipeViewSet(viewsets.ModelViewSet, ExtraAction):
     permission_classes = (IsAuthenticatedOrReadOnly, IsAdminAuthorOrReadOnly)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    SCORE_ORDERINGS = ('popular', 'trending')
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            query_params = self.request.query_params
+            if CursorPagination.cursor_query_param in query_params:
+                self._paginator = CursorPagination()
+            else:
+                self._paginator = PageNumberPagination()
+        return self._paginator
+
+    def get_authors_queryset(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return User.objects.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        return User.objects.annotate(
+            is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('pk'))
+            )
+        )
+
+    def get_score_ordering(self):
+        """
+        Рейтинг из ?ordering=popular|trending для ленты рецептов,
+        None — сортировка по дате создания
+        """
+        ordering = self.request.query_params.get('ordering')
+        if self.action == 'list' and ordering in self.SCORE_ORDERINGS:
+            return ordering
+        return None
+
+    @property
+    def cursor_ordering(self):
+        score = self.get_score_ordering()
+        if score is None:
+            return ('-created', '-id')
+        return (f'-{score}', '-id')
 
     def get_queryset(self):
-        queryset = Recipe.objects.select_related('author').order_by('-created')
+        queryset = Recipe.objects.prefetch_related(
+            Prefetch('author', queryset=self.get_authors_queryset()),
+            Prefetch(
+                'ingredients',
+                queryset=IngredientAmount.objects.select_related('ingredient')
+            ),
+            'tags'
+        ).with_user_flags(self.request.user)
+        score = self.get_score_ordering()
+        if score is not None:
+            queryset = queryset.with_score(score)
+        return queryset.order_by(*self.cursor_ordering)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        key = recipes_cache.make_key(request)
+        data = recipes_cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            recipes_cache.set(key, response.data)
+        return response
 
-        author = self.request.query_params.get('author')
-        if author:
-            queryset = queryset.filter(author=author)
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
 
-        tags = self.request.query_params.getlist('tags')
-        if tags:
-            queryset = queryset.filter(tags__slug__in=tags).distinct()
-        return queryset
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
@@ -178,6 +361,27 @@ class RecipeViewSet(viewsets.ModelViewSet, ExtraAction):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(
+        detail=False, methods=['POST'],
+        permission_classes=(IsAuthenticated,)
+    )
+    def bulk(self, request):
+        serializer = RecipePostSerializer(
+            data=request.data, many=True,
+            context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            recipes = serializer.save(author=request.user)
+        serializer = RecipeGetSerializer(
+            self.get_queryset().filter(
+                id__in=[recipe.id for recipe in recipes]
+            ),
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(
         detail=True, methods=['POST', 'DELETE'],
         permission_classes=(IsAuthenticated,)
@@ -185,6 +389,14 @@ class RecipeViewSet(viewsets.ModelViewSet, ExtraAction):
     def favorite(self, request, pk):
         return self.extra_action(request, Recipe, Favourite, pk)
 
+    @action(
+        detail=False, methods=['POST', 'DELETE'],
+        url_path='favorite', url_name='favorite-bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def favorite_bulk(self, request):
+        return self.bulk_extra_action(request, Recipe, Favourite)
+
     @action(
         detail=True, methods=['POST', 'DELETE'],
         permission_classes=(IsAuthenticated,)
@@ -192,48 +404,98 @@ class RecipeViewSet(viewsets.ModelViewSet, ExtraAction):
     def shopping_cart(self, request, pk):
         return self.extra_action(request, Recipe, ShoppingCart, pk)
 
+    @action(
+        detail=False, methods=['POST', 'DELETE'],
+        url_path='shopping_cart', url_name='shopping-cart-bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def shopping_cart_bulk(self, request):
+        return self.bulk_extra_action(request, Recipe, ShoppingCart)
+
+    @staticmethod
+    def get_shopping_cart_amounts(user):
+        return IngredientAmount.objects.filter(
+            recipe_id__in=user.shoppingcart.values('recipe_id')
+        )
+
+    @staticmethod
+    def get_shopping_cart_ingredients(ingredient_amounts):
+        return ingredient_amounts.values(
+            'ingredient__name', 'ingredient__measurement_unit'
+        ).annotate(
+            total_amount=Sum('amount')
+        ).order_by(
+            'ingredient__name', 'ingredient__measurement_unit'
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit',
+            'total_amount'
+        )
+
+    @staticmethod
+    def get_shopping_cart_etag(ingredients, file_format):
+        """
+        ETag строится из тех же строк (название, единица измерения,
+        количество), что попадают в файл, поэтому меняется и при
+        изменении справочника ингредиентов
+        """
+        return quote_etag(hashlib.md5(
+            f'{file_format}:{ingredients}'.encode()
+        ).hexdigest())
+
     @action(
         detail=False, methods=['GET'],
         url_path='download_shopping_cart',
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=SHOPPING_CART_RENDERERS
     )
     def download_shopping_cart(self, request):
-        short_names = {
-            'name': 'recipe__ingredients__ingredient__name',
-            'measurement_unit':
-            'recipe__ingredients__ingredient__measurement_unit',
-            'amount': 'recipe__ingredients__amount',
-            'sum_amount': 'recipe__ingredients__amount__sum'
-        }
-
-        shopping_carts = request.user.shoppingcart.select_related(
-            'recipe'
-        ).values(
-            short_names['name'],
-            short_names['measurement_unit']
-        ).annotate(Sum(short_names['amount']))
-
-        ingredients_list = ''
-        for ingredient in shopping_carts:
-            ingredients_list += (
-                f'{ingredient.get(short_names["name"])}: '
-                f'{ingredient.get(short_names["sum_amount"])} '
-                f'{ingredient.get(short_names["measurement_unit"])}\n'
-            )
-        response = HttpResponse(ingredients_list, content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; filename="list.txt"'
+        renderer = request.accepted_renderer
+        ingredients = list(self.get_shopping_cart_ingredients(
+            self.get_shopping_cart_amounts(request.user)
+        ))
+
+        etag = self.get_shopping_cart_etag(ingredients, renderer.format)
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients),
+            content_type=renderer.content_type
+        )
+        response['ETag'] = etag
+        response['Content-Disposition'] = (
+            f'attachment; filename="{renderer.filename}"'
+        )
         return response
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Ingredient.objects.order_by('pk')
     serializer_class = IngredientSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
     pagination_class = None
-    filter_backends = (filters.SearchFilter,)
-    search_fields = ('@name',)
+    filter_backends = (IngredientSearchFilter,)
+    list_cache = ingredients_cache
 
-    def get_queryset(self):
-        name = self.request.query_params.get('name')
-        if name:
-            return Ingredient.objects.filter(name__startswith=name)
-        return Ingredient.objects.order_by('pk')
+    def use_list_cache(self, request):
+        return not request.query_params.get(
+            IngredientSearchFilter.search_param
+        )
+
+
+def metrics(request):
+    """
+    Метрики текущего воркера в текстовом формате Prometheus.
+    Обычный view Django без аутентификации DRF, чтобы сбор был дешёвым
+    """
+    token = settings.METRICS_TOKEN
+    if token and not hmac.compare_digest(
+        request.headers.get('Authorization', ''), f'Bearer {token}'
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4'
+    )
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 from dotenv import load_dotenv
 
@@ -33,6 +34,9 @@ SECRET_KEY = os.getenv(
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = (os.getenv('DEBUG', 'True') == 'True')
 
+# manage.py test
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = ['*']
 
 
@@ -62,6 +66,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.QueryInstrumentationMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -104,11 +109,76 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='127.0.0.1'),
-        'PORT': os.getenv('DB_PORT', default='5432')
+        'PORT': os.getenv('DB_PORT', default='5432'),
+        # Секунды жизни постоянного соединения, 0 — новое на каждый запрос
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        # Проверка соединения перед запросом (в Django 3.2 выполняется
+        # api.signals.check_connections, с 4.1 — самим Django)
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+        ),
+        # PgBouncer в режиме transaction не поддерживает серверные курсоры
+        'DISABLE_SERVER_SIDE_CURSORS': (
+            os.getenv('DB_PGBOUNCER', 'False') == 'True'
+        ),
+        # Для SQLite тестовая база по умолчанию в памяти, где параллельные
+        # потоки блокируют таблицы. Файл позволяет запускать тесты
+        # одновременных запросов
+        'TEST': {'NAME': os.getenv('DB_TEST_NAME')},
     }
 }
 
 
+# В кэше по умолчанию хранятся общие для всех процессов версии кэшей
+# справочников и ответов, поэтому он не может быть LocMemCache:
+# сброс из другого воркера или management-команды не дошёл бы до процесса
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', default='/tmp/foodgram_cache'
+        ),
+    }
+}
+
+# Наибольшее время в секундах, которое воркер отдаёт справочник из памяти,
+# не перестраивая его, даже если сброс версии до него не дошёл
+CATALOGUE_CACHE_TTL = int(os.getenv('CATALOGUE_CACHE_TTL', default=300))
+
+# Кэш ответов для анонимных пользователей: locmem, file, redis или dummy.
+# Для redis необходимо установить пакет django-redis
+RESPONSE_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv(
+            'RESPONSE_CACHE_LOCATION', default='/tmp/foodgram_responses'
+        ),
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv(
+            'RESPONSE_CACHE_LOCATION', default='redis://127.0.0.1:6379/1'
+        ),
+    },
+    'dummy': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+RESPONSE_CACHE_ALIAS = 'responses'
+CACHES[RESPONSE_CACHE_ALIAS] = RESPONSE_CACHE_BACKENDS[
+    os.getenv('RESPONSE_CACHE', default='locmem')
+]
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', default=300))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -151,6 +221,36 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Максимальная сторона уменьшенных копий картинок рецептов
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': 240,
+    'card': 640,
+    'full': 1280,
+}
+RECIPE_IMAGE_FORMATS = ('webp', 'jpeg')
+
+# Ограничения на загружаемые картинки, файлы больше
+# FILE_UPLOAD_MAX_MEMORY_SIZE пишутся во временный файл на диске
+FILE_UPLOAD_MAX_SIZE = int(
+    os.getenv('FILE_UPLOAD_MAX_SIZE', default=10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_DIMENSION = int(
+    os.getenv('RECIPE_IMAGE_MAX_DIMENSION', default=6000)
+)
+FILE_UPLOAD_HANDLERS = [
+    'api.upload_handlers.MaxSizeUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# thread, process или sync
+IMAGE_PROCESSING_EXECUTOR = os.getenv(
+    'IMAGE_PROCESSING_EXECUTOR', default='thread'
+)
+IMAGE_PROCESSING_WORKERS = int(
+    os.getenv('IMAGE_PROCESSING_WORKERS', default=2)
+)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -197,3 +297,65 @@ MAX_LENGTH_LIMITS = {
         'name': 200
     }
 }
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Рейтинги рецептов для сортировки ?ordering=popular|trending:
+# вес добавления и период полураспада в днях
+RECIPE_SCORE_WEIGHTS = {
+    'favourite': 1.0,
+    'shopping_cart': 0.5,
+}
+RECIPE_SCORE_HALF_LIFE_DAYS = {
+    'popular': 90,
+    'trending': 3,
+}
+
+# Наибольшее число id в одном запросе пакетного добавления или удаления
+BULK_ACTION_MAX_IDS = 1000
+
+# Допустимое число SQL-запросов по имени view (или 'МЕТОД имя_view')
+# для api.middleware.QueryInstrumentationMiddleware.
+# QUERY_BUDGET_MODE: log — предупреждение в лог, raise — исключение
+QUERY_BUDGETS = {
+    'GET api:recipes-list': 8,
+    'GET api:recipes-detail': 6,
+    'api:recipes-favorite': 5,
+    'api:recipes-shopping-cart': 5,
+    'api:recipes-download-shopping-cart': 4,
+    'GET api:subscriptions': 6,
+    'api:subscribe': 8,
+    'GET api:tags-list': 3,
+    'GET api:ingredients-list': 3,
+}
+QUERY_BUDGET_MODE = os.getenv('QUERY_BUDGET_MODE', default='log')
+
+# wsgi — синхронные воркеры gunicorn, asgi — воркеры uvicorn,
+# в которых view API выполняются в пуле из ASYNC_VIEW_THREADS потоков
+SERVER_MODE = os.getenv('SERVER_MODE', default='wsgi')
+ASYNC_VIEW_THREADS = int(os.getenv('ASYNC_VIEW_THREADS', default=16))
+
+# Если задан, /api/metrics требует заголовок Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.middleware': {
+            'handlers': ['console'],
+            'level': os.getenv('QUERY_LOG_LEVEL', default=(
+                'WARNING' if TESTING else 'INFO'
+            )),
+            'propagate': False,
+        },
+    },
+}
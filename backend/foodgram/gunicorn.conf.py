@@ -0,0 +1,45 @@
+"""
+Настройки gunicorn.
+SERVER_MODE=asgi запускает приложение ASGI в воркерах uvicorn,
+по умолчанию используются синхронные воркеры WSGI.
+WEB_CONCURRENCY задаёт число воркеров, GUNICORN_THREADS — число потоков
+в воркере: потоков gthread в режиме WSGI и пула view в режиме ASGI.
+Каждый поток держит своё постоянное соединение с базой, поэтому от этих
+чисел зависит, сколько соединений откроет приложение
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+
+if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    threads = int(os.getenv(
+        'ASYNC_VIEW_THREADS', os.getenv('GUNICORN_THREADS', 16)
+    ))
+    os.environ['ASYNC_VIEW_THREADS'] = str(threads)
+    # Общий поток Django для синхронного кода вне пула
+    connections_per_worker = threads + 1
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+    connections_per_worker = threads
+
+if os.getenv('IMAGE_PROCESSING_EXECUTOR', 'thread') != 'sync':
+    connections_per_worker += int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+
+
+def on_starting(server):
+    expected = workers * connections_per_worker
+    server.log.info(
+        'Up to %s database connections: %s workers x %s',
+        expected, workers, connections_per_worker
+    )
+    limit = os.getenv('DB_MAX_CONNECTIONS')
+    if limit and expected > int(limit):
+        server.log.warning(
+            'Expected %s database connections exceed DB_MAX_CONNECTIONS=%s, '
+            'lower WEB_CONCURRENCY or GUNICORN_THREADS, or use PgBouncer',
+            expected, limit
+        )
@@ -36,8 +36,11 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('name', 'author__username', 'tags')
     filter_vertical = ('tags',)
 
+    @admin.display(
+        description='Добавлений в избранное', ordering='favourites_count'
+    )
     def num_favourite(self, obj):
-        return Favourite.objects.filter(recipe=obj).count()
+        return obj.favourites_count
 
 
 @admin.register(Favourite)
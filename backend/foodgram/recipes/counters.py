@@ -0,0 +1,71 @@
+"""
+Денормализованные счётчики: Recipe.favourites_count,
+User.recipes_count и User.followers_count
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Follow
+from .models import Favourite, Recipe
+
+User = get_user_model()
+
+
+def change_counter(model, pk, field, delta):
+    """
+    Атомарно изменяет счётчик одной строки без чтения значения.
+    Разошедшийся с данными счётчик не уходит ниже нуля
+    """
+    change_counters(model, [pk], field, delta)
+
+
+def change_counters(model, pks, field, delta):
+    """Изменяет счётчик сразу у нескольких строк одним UPDATE"""
+    if not pks:
+        return
+    rows = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        rows = rows.filter(**{f'{field}__gte': -delta})
+    rows.update(**{field: F(field) + delta})
+
+
+def count_subquery(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(count=Count('pk')).values('count'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def repair_counter(queryset, field, model, related_field):
+    """
+    Пересчитывает счётчик по связанной таблице и
+    возвращает число исправленных строк
+    """
+    actual = count_subquery(model, related_field)
+    return queryset.annotate(actual=actual).exclude(
+        **{field: F('actual')}
+    ).update(**{field: actual})
+
+
+def recount(recipes=None, users=None):
+    if recipes is None:
+        recipes = Recipe.objects.all()
+    if users is None:
+        users = User.objects.all()
+    return {
+        'favourites_count': repair_counter(
+            recipes, 'favourites_count', Favourite, 'recipe'
+        ),
+        'recipes_count': repair_counter(
+            users, 'recipes_count', Recipe, 'author'
+        ),
+        'followers_count': repair_counter(
+            users, 'followers_count', Follow, 'author'
+        ),
+    }
@@ -0,0 +1,179 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {
+        'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True
+    },
+}
+
+
+def save_variant(image, file_format):
+    """
+    Сохраняет изображение без метаданных под именем,
+    построенным из хэша содержимого
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, **SAVE_OPTIONS[file_format])
+    content = buffer.getvalue()
+    digest = hashlib.sha256(content).hexdigest()[:32]
+    path = f'recipes/variants/{digest}.{file_format}'
+    if not default_storage.exists(path):
+        path = default_storage.save(path, ContentFile(content))
+    return path
+
+
+def build_image_variants(image_file):
+    """
+    Строит уменьшенные копии изображения для всех размеров из
+    settings.RECIPE_IMAGE_VARIANTS во всех форматах из
+    settings.RECIPE_IMAGE_FORMATS
+    """
+    with Image.open(image_file) as source:
+        image = ImageOps.exif_transpose(source)
+        image = image.convert('RGB')
+
+    variants = {}
+    for name, size in settings.RECIPE_IMAGE_VARIANTS.items():
+        variant = image.copy()
+        variant.thumbnail((size, size), Image.LANCZOS)
+        variants[name] = {'width': variant.width, 'height': variant.height}
+        for file_format in settings.RECIPE_IMAGE_FORMATS:
+            variants[name][file_format] = save_variant(variant, file_format)
+    return variants
+
+
+def process_recipe_image(recipe_id, replaced_variants=None):
+    """
+    Варианты заменённой картинки удаляются только после сохранения
+    новых: если содержимое то же, save_variant не перезаписывает
+    существующие файлы, и они снова нужны рецепту
+    """
+    from .models import Recipe
+
+    try:
+        recipe = Recipe.objects.filter(id=recipe_id).first()
+        if recipe is None or not recipe.image:
+            return
+        with recipe.image.open('rb') as image_file:
+            variants = build_image_variants(image_file)
+        # Картинку могли заменить, пока шла обработка
+        updated = Recipe.objects.filter(
+            id=recipe_id, image=recipe.image.name
+        ).update(image_variants=variants)
+        if updated:
+            # update() не отправляет сигналов, а анонимные ответы,
+            # закэшированные до обработки, содержат пустой image_srcset
+            from api.cache import recipes_cache
+
+            recipes_cache.invalidate()
+    except Exception:
+        logger.exception('Failed to process image of recipe %s', recipe_id)
+    if replaced_variants:
+        try:
+            delete_unused_variants(replaced_variants)
+        except Exception:
+            logger.exception(
+                'Failed to delete old image variants of recipe %s', recipe_id
+            )
+
+
+def delete_unused_variants(variants):
+    """
+    Удаляет файлы вариантов, на которые больше не ссылается ни один
+    рецепт. Имена файлов строятся из хэша содержимого, поэтому одинаковые
+    картинки разных рецептов делят одни и те же файлы
+    """
+    from .models import Recipe
+
+    paths = {
+        variant[file_format]
+        for variant in variants.values()
+        for file_format in SAVE_OPTIONS
+        if file_format in variant
+    }
+    for path in paths:
+        if not Recipe.objects.filter(image_variants__icontains=path).exists():
+            default_storage.delete(path)
+
+
+def process_recipe_image_in_worker(recipe_id, replaced_variants=None):
+    """
+    Рабочие потоки и процессы не проходят через обработку запроса Django,
+    поэтому соединения с базой закрываются здесь
+    """
+    close_old_connections()
+    try:
+        process_recipe_image(recipe_id, replaced_variants)
+    finally:
+        close_old_connections()
+
+
+class ImageProcessingQueue:
+    """
+    Очередь фоновой обработки картинок рецептов.
+    settings.IMAGE_PROCESSING_EXECUTOR задаёт исполнителя:
+    thread — пул потоков, process — пул процессов,
+    sync — обработка сразу в вызывающем потоке (для тестов и отладки)
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            return self.create_executor()
+
+    def create_executor(self):
+        if self.executor is None:
+            kind = settings.IMAGE_PROCESSING_EXECUTOR
+            workers = settings.IMAGE_PROCESSING_WORKERS
+            if kind == 'thread':
+                self.executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix='images'
+                )
+            elif kind == 'process':
+                self.executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=django.setup
+                )
+        return self.executor
+
+    @property
+    def depth(self):
+        return self.pending
+
+    def task_done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def submit(self, recipe_id, replaced_variants=None):
+        executor = self.get_executor()
+        if executor is None:
+            process_recipe_image(recipe_id, replaced_variants)
+            return
+        with self.lock:
+            self.pending += 1
+        executor.submit(
+            process_recipe_image_in_worker, recipe_id, replaced_variants
+        ).add_done_callback(self.task_done)
+
+
+image_queue = ImageProcessingQueue()
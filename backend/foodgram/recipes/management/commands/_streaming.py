@@ -0,0 +1,137 @@
+"""
+Общие помощники команд импорта и экспорта: потоковое чтение
+JSON/NDJSON/CSV, запись NDJSON/CSV, разбиение на пачки
+и файл контрольной точки
+"""
+import csv
+import itertools
+import json
+import os
+
+from django.core.management.base import CommandError
+
+FORMATS = ('ndjson', 'csv')
+
+
+def detect_format(path, file_format=None):
+    if file_format:
+        return file_format
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension in ('ndjson', 'jsonl'):
+        return 'ndjson'
+    if extension in ('csv', 'json'):
+        return extension
+    raise CommandError(
+        f'Cannot detect format of {path}, use --format'
+    )
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_ndjson(file):
+    for line_number, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            raise CommandError(f'Line {line_number}: {error}')
+
+
+def iter_json_array(file, buffer_size=65536):
+    """
+    Читает элементы JSON-массива по одному, не загружая
+    весь файл в память
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(buffer_size).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('JSON file must contain an array')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except ValueError as error:
+            chunk = file.read(buffer_size)
+            if not chunk:
+                raise CommandError(f'Invalid JSON: {error}')
+            buffer += chunk
+            continue
+        # Число в конце буфера могло прочитаться не полностью
+        if end == len(buffer):
+            chunk = file.read(buffer_size)
+            if chunk:
+                buffer += chunk
+                continue
+        yield item
+        buffer = buffer[end:]
+
+
+def iter_csv(file, fieldnames=None):
+    yield from csv.DictReader(file, fieldnames=fieldnames)
+
+
+def read_records(file, file_format, fieldnames=None):
+    if file_format == 'ndjson':
+        return iter_ndjson(file)
+    if file_format == 'json':
+        return iter_json_array(file)
+    return iter_csv(file, fieldnames)
+
+
+class RecordWriter:
+    def __init__(self, file, file_format, fieldnames):
+        self.file = file
+        self.file_format = file_format
+        if file_format == 'csv':
+            self.writer = csv.DictWriter(file, fieldnames=fieldnames)
+            self.writer.writeheader()
+
+    def write(self, record):
+        if self.file_format == 'csv':
+            self.writer.writerow(record)
+        else:
+            self.file.write(
+                json.dumps(record, ensure_ascii=False, default=str) + '\n'
+            )
+
+
+class Checkpoint:
+    """
+    Число обработанных записей исходного файла.
+    Файл переписывается атомарно после каждой закоммиченной пачки
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path, encoding='utf-8') as file:
+            state = json.load(file)
+        if state.get('source') != self.source:
+            raise CommandError(
+                f'Checkpoint {self.path} belongs to {state.get("source")}'
+            )
+        return state.get('processed', 0)
+
+    def save(self, processed):
+        if not self.path:
+            return
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump({'source': self.source, 'processed': processed}, file)
+        os.replace(temporary_path, self.path)
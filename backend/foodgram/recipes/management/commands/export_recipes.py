@@ -0,0 +1,97 @@
+import sys
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import IngredientAmount, Recipe
+from ._streaming import FORMATS, RecordWriter, detect_format
+
+FIELDNAMES = (
+    'id', 'author', 'created', 'name', 'text', 'image', 'cooking_time',
+    'tags', 'ingredients'
+)
+
+
+class Command(BaseCommand):
+    help = 'Exporting recipes to NDJSON or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Output file, "-" for stdout')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def fetch_chunk(self, last_id, chunk_size):
+        recipes = list(
+            Recipe.objects.filter(id__gt=last_id).order_by('id').values(
+                'id', 'author_id', 'created', 'name', 'text', 'image',
+                'cooking_time'
+            )[:chunk_size]
+        )
+        recipe_ids = [recipe['id'] for recipe in recipes]
+        tags = defaultdict(list)
+        for recipe_id, tag_id in Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('tag_id').values_list('recipe_id', 'tag_id'):
+            tags[recipe_id].append(tag_id)
+        ingredients = defaultdict(list)
+        amounts = IngredientAmount.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('id').values_list('recipe_id', 'ingredient_id', 'amount')
+        for recipe_id, ingredient_id, amount in amounts:
+            ingredients[recipe_id].append(
+                {'id': ingredient_id, 'amount': amount}
+            )
+        for recipe in recipes:
+            recipe['author'] = recipe.pop('author_id')
+            recipe['created'] = recipe['created'].isoformat()
+            recipe['tags'] = tags[recipe['id']]
+            recipe['ingredients'] = ingredients[recipe['id']]
+        return recipes
+
+    def to_csv(self, record):
+        record['tags'] = ';'.join(str(tag) for tag in record['tags'])
+        record['ingredients'] = ';'.join(
+            f'{ingredient["id"]}:{ingredient["amount"]}'
+            for ingredient in record['ingredients']
+        )
+        return record
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or (
+            'ndjson' if path == '-' else detect_format(path)
+        )
+        file = (
+            sys.stdout if path == '-'
+            else open(path, 'w', encoding='utf-8', newline='')
+        )
+        # При выводе в stdout отчёт пишется в stderr, чтобы не испортить файл
+        report = self.stderr if path == '-' else self.stdout
+        writer = RecordWriter(file, file_format, FIELDNAMES)
+        exported = 0
+        last_id = 0
+        started = time.monotonic()
+        try:
+            while True:
+                recipes = self.fetch_chunk(last_id, options['chunk_size'])
+                if not recipes:
+                    break
+                for record in recipes:
+                    if file_format == 'csv':
+                        record = self.to_csv(record)
+                    writer.write(record)
+                exported += len(recipes)
+                last_id = recipes[-1]['id']
+                elapsed = time.monotonic() - started
+                report.write(
+                    f'Exported {exported} recipes, '
+                    f'{exported / elapsed:.0f} rows/s'
+                )
+        finally:
+            if file is not sys.stdout:
+                file.close()
+        elapsed = time.monotonic() - started
+        report.write(self.style.SUCCESS(
+            f'Recipes exported: {exported} in {elapsed:.1f} s'
+        ))
@@ -0,0 +1,210 @@
+import itertools
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from api.cache import recipes_cache
+from recipes.counters import repair_counter
+from recipes.models import (
+    Ingredient, IngredientAmount, Recipe, RecipeScore, Tag
+)
+from users.models import User
+from ._streaming import (
+    FORMATS, Checkpoint, chunked, detect_format, read_records
+)
+
+
+def parse_ids(value):
+    if isinstance(value, list):
+        return [int(item) for item in value]
+    return [int(item) for item in value.split(';') if item]
+
+
+def parse_ingredients(value):
+    if isinstance(value, list):
+        return [(int(item['id']), int(item['amount'])) for item in value]
+    return [
+        tuple(int(part) for part in item.split(':'))
+        for item in value.split(';') if item
+    ]
+
+
+def reset_sequences(*models):
+    """
+    Сдвигает последовательности id после вставки строк с явными id,
+    иначе следующий INSERT без id упадёт на дубликате ключа (PostgreSQL)
+    """
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+
+class Command(BaseCommand):
+    help = 'Importing recipes from NDJSON or CSV file of export_recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Records read and committed in one transaction'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Rows in one INSERT statement'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='File with number of processed records, '
+                 'the import continues from it when restarted'
+        )
+
+    def parse(self, record):
+        try:
+            return {
+                'id': int(record['id']),
+                'author_id': int(record['author']),
+                'created': parse_datetime(record['created']),
+                'name': record['name'],
+                'text': record['text'],
+                'image': record['image'],
+                'cooking_time': int(record['cooking_time']),
+                'tags': parse_ids(record['tags']),
+                'ingredients': parse_ingredients(record['ingredients']),
+            }
+        except (KeyError, TypeError, ValueError) as error:
+            raise CommandError(f'Invalid record {record}: {error!r}')
+
+    def existing(self, model, ids):
+        return set(
+            model.objects.filter(id__in=set(ids)).values_list('id', flat=True)
+        )
+
+    def import_chunk(self, records, batch_size):
+        """
+        Вставляет рецепты, которых ещё нет в базе. Записи со ссылками
+        на несуществующих авторов, теги или ингредиенты пропускаются,
+        потому что ON CONFLICT не защищает от нарушения внешних ключей
+        """
+        present = self.existing(Recipe, (record['id'] for record in records))
+        authors = self.existing(
+            User, (record['author_id'] for record in records)
+        )
+        tags = self.existing(Tag, itertools.chain.from_iterable(
+            record['tags'] for record in records
+        ))
+        ingredients = self.existing(Ingredient, (
+            ingredient_id
+            for record in records
+            for ingredient_id, _ in record['ingredients']
+        ))
+
+        new_records = [
+            record for record in records
+            if record['id'] not in present
+            and record['author_id'] in authors
+            and tags.issuperset(record['tags'])
+            and ingredients.issuperset(
+                ingredient_id for ingredient_id, _ in record['ingredients']
+            )
+        ]
+        skipped = len(records) - len(new_records) - len(present)
+        recipes = [
+            Recipe(
+                id=record['id'],
+                author_id=record['author_id'],
+                name=record['name'],
+                text=record['text'],
+                image=record['image'],
+                cooking_time=record['cooking_time'],
+            )
+            for record in new_records
+        ]
+        Recipe.objects.bulk_create(
+            recipes, batch_size=batch_size, ignore_conflicts=True
+        )
+        RecipeScore.objects.bulk_create(
+            [RecipeScore(recipe_id=record['id']) for record in new_records],
+            batch_size=batch_size, ignore_conflicts=True
+        )
+        # auto_now_add подменяет дату при вставке, исходная
+        # дата создания восстанавливается отдельным запросом
+        for recipe, record in zip(recipes, new_records):
+            recipe.created = record['created']
+        Recipe.objects.bulk_update(recipes, ['created'], batch_size=batch_size)
+        Recipe.tags.through.objects.bulk_create(
+            [
+                Recipe.tags.through(recipe_id=record['id'], tag_id=tag_id)
+                for record in new_records
+                for tag_id in set(record['tags'])
+            ],
+            batch_size=batch_size, ignore_conflicts=True
+        )
+        IngredientAmount.objects.bulk_create(
+            [
+                IngredientAmount(
+                    recipe_id=record['id'],
+                    ingredient_id=ingredient_id,
+                    amount=amount
+                )
+                for record in new_records
+                for ingredient_id, amount in record['ingredients']
+            ],
+            batch_size=batch_size, ignore_conflicts=True
+        )
+        # bulk_create не отправляет сигналы, поэтому счётчики рецептов
+        # авторов пересчитываются для каждой пачки
+        repair_counter(
+            User.objects.filter(
+                id__in={record['author_id'] for record in new_records}
+            ),
+            'recipes_count', Recipe, 'author'
+        )
+        return len(new_records), skipped
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = detect_format(path, options['format'])
+        checkpoint = Checkpoint(options['checkpoint'], path)
+        processed = resumed = checkpoint.load()
+        if processed:
+            self.stdout.write(f'Resuming after {processed} records')
+
+        created = skipped = 0
+        started = time.monotonic()
+        with open(path, encoding='utf-8', newline='') as file:
+            records = itertools.islice(
+                read_records(file, file_format), processed, None
+            )
+            for chunk in chunked(records, options['chunk_size']):
+                chunk = [self.parse(record) for record in chunk]
+                with transaction.atomic():
+                    chunk_created, chunk_skipped = self.import_chunk(
+                        chunk, options['batch_size']
+                    )
+                processed += len(chunk)
+                created += chunk_created
+                skipped += chunk_skipped
+                checkpoint.save(processed)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Processed {processed} records, created {created}, '
+                    f'{(processed - resumed) / elapsed:.0f} rows/s'
+                )
+
+        reset_sequences(Recipe)
+        recipes_cache.invalidate()
+        elapsed = time.monotonic() - started
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Skipped {skipped} records with unknown author, '
+                f'tags or ingredients'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Recipes imported: {created} in {elapsed:.1f} s'
+        ))
@@ -1,41 +1,102 @@
 import os
-import json
+import time
 
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
-from django.db import IntegrityError
+from django.db import transaction
 
+from api.cache import ingredients_cache
 from recipes.models import Ingredient
+from ._streaming import chunked, detect_format, read_records
+
+FIELDNAMES = ('name', 'measurement_unit')
 
 
 class Command(BaseCommand):
     help = 'Loading initial data'
 
-    def handle(self, *args, **options):
-        path_to_json = os.path.join(
-            settings.BASE_DIR,
-            'data',
-            'ingredients.json'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=os.path.join(
+                settings.BASE_DIR, 'data', 'ingredients.json'
+            ),
+            help='JSON, NDJSON or CSV file with ingredients'
+        )
+        parser.add_argument('--format', choices=('json', 'ndjson', 'csv'))
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Show ingredients that would be added without saving them'
         )
 
-        if not os.path.exists(path_to_json):
+    def read_ingredients(self, path, file_format):
+        with open(path, encoding='utf-8', newline='') as file:
+            for record in read_records(file, file_format, FIELDNAMES):
+                try:
+                    yield (
+                        record['name'].strip(),
+                        record['measurement_unit'].strip()
+                    )
+                except (AttributeError, KeyError, TypeError):
+                    raise CommandError(f'Invalid ingredient {record}')
+
+    def get_new(self, batch, seen):
+        """
+        Отбирает из пачки ингредиенты, которых нет ни в базе,
+        ни в уже прочитанной части файла
+        """
+        existing = set(Ingredient.objects.filter(
+            name__in={name for name, _ in batch}
+        ).values_list('name', 'measurement_unit'))
+        new = []
+        for ingredient in batch:
+            if ingredient not in existing and ingredient not in seen:
+                new.append(ingredient)
+                seen.add(ingredient)
+        return new
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
             raise CommandError('No file with initial data')
+        file_format = detect_format(path, options['format'])
+        dry_run = options['dry_run']
 
-        with open(path_to_json, encoding='utf-8') as file:
-            try:
-                json_data = json.load(file)
+        started = time.monotonic()
+        read = created = 0
+        seen = set()
+        for batch in chunked(
+            self.read_ingredients(path, file_format), options['batch_size']
+        ):
+            read += len(batch)
+            new = self.get_new(batch, seen)
+            created += len(new)
+            if dry_run:
+                for name, measurement_unit in new:
+                    self.stdout.write(f'+ {name} ({measurement_unit})')
+                continue
+            # Строки, добавленные параллельно другим процессом,
+            # пропускаются через ON CONFLICT DO NOTHING
+            with transaction.atomic():
                 Ingredient.objects.bulk_create(
-                    [Ingredient(**ingredient) for ingredient in json_data]
-                )
-            except IntegrityError:
-                self.stdout.write(self.style.ERROR(
-                        'Such ingredients already present in database'
-                    )
-                )
-                return
-            except Exception as error:
-                raise CommandError(
-                    'Error occured while loading itial data: ' + str(error)
+                    [
+                        Ingredient(name=name, measurement_unit=unit)
+                        for name, unit in new
+                    ],
+                    ignore_conflicts=True
                 )
 
-        self.stdout.write(self.style.SUCCESS('Data loaded'))
+        elapsed = time.monotonic() - started
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f'Read {read}, would add {created}, '
+                f'unchanged {read - created}'
+            ))
+            return
+        if created:
+            ingredients_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Data loaded: read {read}, added {created}, '
+            f'unchanged {read - created} in {elapsed:.1f} s'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.counters import recount
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalculating favourites, recipes and followers counters. '
+        'Counters drift when rows are removed by cascade deletion '
+        'or loaded with bulk_create'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            repaired = recount()
+        for field, rows in repaired.items():
+            self.stdout.write(f'{field}: repaired {rows} rows')
+        self.stdout.write(self.style.SUCCESS('Counters recalculated'))
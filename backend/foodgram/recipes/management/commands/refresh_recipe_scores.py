@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.cache import recipes_cache
+from recipes.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    help = 'Recalculating popular and trending scores of recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        scored = refresh_scores(batch_size=options['batch_size'])
+        recipes_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Scores refreshed: {scored} recipes with activity '
+            f'in {time.monotonic() - started:.1f} s'
+        ))
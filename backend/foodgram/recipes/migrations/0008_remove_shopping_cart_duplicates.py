@@ -0,0 +1,27 @@
+# Generated by Django 3.2.18 on 2026-10-18 19:10
+
+from django.db import migrations
+from django.db.models import Min
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+    Оставляет самую раннюю запись каждой пары (user, recipe)
+    перед добавлением ограничения уникальности
+    """
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    first_ids = ShoppingCart.objects.values('user', 'recipe').annotate(
+        first_id=Min('id')
+    ).values('first_id')
+    ShoppingCart.objects.exclude(id__in=first_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_scores'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.18 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_remove_shopping_cart_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='shopping_cart_unique'),
+        ),
+    ]
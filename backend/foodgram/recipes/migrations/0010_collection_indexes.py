@@ -0,0 +1,38 @@
+# Generated by Django 3.2.18 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+
+def create_covering_index(apps, schema_editor):
+    """
+    Список покупок суммирует amount по рецептам из корзины:
+    с INCLUDE (amount) это Index Only Scan без чтения таблицы
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS ingredient_amount_cover_idx '
+        'ON recipes_ingredientamount (recipe_id, ingredient_id) '
+        'INCLUDE (amount)'
+    )
+
+
+def drop_covering_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_amount_cover_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_shoppingcart_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-created', '-id'], name='recipe_author_created_idx'),
+        ),
+        migrations.RunPython(create_covering_index, drop_covering_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_collection_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(help_text='Добавьте картинку к посту', upload_to='recipes', verbose_name='Картинка к рецепту'),
+        ),
+    ]
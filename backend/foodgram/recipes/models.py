@@ -3,9 +3,12 @@ from django.core.validators import (
     MinValueValidator, MaxValueValidator
 )
 from django.db import models
+from django.db.models import Exists, F, OuterRef, Value, Window
+from django.db.models.functions import RowNumber
 from django.conf import settings
 
 from .validators import validate_tag_color, validate_ingredient
+from users.models import UserRelationQuerySet
 from users.validators import only_letters_validator
 
 
@@ -69,11 +72,71 @@ class Ingredient(models.Model):
                 fields=('name', 'measurement_unit'),
                 name='unique_ingredient'),
         )
+        indexes = (
+            models.Index(
+                fields=('name',),
+                name='ingredient_name_prefix_idx',
+                opclasses=('varchar_pattern_ops',)
+            ),
+        )
 
     def __str__(self) -> str:
         return f'{self.name} ({self.measurement_unit})'
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        """
+        Аннотирует рецепты флагами is_favorited и is_in_shopping_cart
+        для пользователя user одним запросом вместо запроса на каждый рецепт
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                )
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favourite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            )
+        )
+
+    def latest_by_author(self, author_ids, limit):
+        """
+        Возвращает не более limit последних рецептов каждого автора
+        одним запросом с оконной функцией ROW_NUMBER(), от новых к старым.
+        Порядок строк внешнего запроса без ORDER BY не гарантирован
+        """
+        ranked = self.filter(author_id__in=author_ids).annotate(
+            author_rank=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('created').desc(), F('id').desc())
+            )
+        )
+        sql, params = ranked.query.sql_with_params()
+        return self.model.objects.raw(
+            f'SELECT * FROM ({sql}) AS ranked '
+            'WHERE ranked.author_rank <= %s '
+            'ORDER BY ranked.author_id, ranked.author_rank',
+            (*params, limit)
+        )
+
+    def with_score(self, name):
+        """
+        Добавляет рейтинг name из таблицы RecipeScore.
+        Рецепты, для которых рейтинг ещё не посчитан, не попадают в выборку
+        """
+        return self.filter(score__isnull=False).annotate(
+            **{name: F(f'score__{name}')}
+        )
+
+
 class Recipe(models.Model):
     created = models.DateTimeField(
         auto_now_add=True,
@@ -107,16 +170,38 @@ class Recipe(models.Model):
         verbose_name='Картинка к рецепту',
         help_text='Добавьте картинку к посту'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии картинки'
+    )
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления (в минутах)',
         help_text='Укажите время приготовления блюда',
         validators=(MinValueValidator(1), MaxValueValidator(300))
     )
+    favourites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в избранное'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(
+                fields=('-created', '-id'), name='recipe_created_id_idx'
+            ),
+            models.Index(
+                fields=('author', '-created', '-id'),
+                name='recipe_author_created_idx'
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -164,6 +249,12 @@ class Favourite(models.Model):
         on_delete=models.CASCADE,
         related_name='+'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления'
+    )
+
+    objects = UserRelationQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Избранная подписка'
@@ -191,7 +282,56 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         related_name='+'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления'
+    )
+
+    objects = UserRelationQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Покупка'
         verbose_name_plural = 'Покупки'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='shopping_cart_unique'
+            ),
+        )
+
+
+class RecipeScore(models.Model):
+    """
+    Рейтинги рецепта по затухающему числу добавлений в избранное
+    и в список покупок. Пересчитываются командой refresh_recipe_scores
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт'
+    )
+    popular = models.FloatField(default=0, verbose_name='Популярность')
+    trending = models.FloatField(
+        default=0,
+        verbose_name='Популярность за последние дни'
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата пересчёта'
+    )
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = (
+            models.Index(
+                fields=('-popular', '-recipe'),
+                name='recipe_score_popular_idx'
+            ),
+            models.Index(
+                fields=('-trending', '-recipe'),
+                name='recipe_score_trending_idx'
+            ),
+        )
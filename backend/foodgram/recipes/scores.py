@@ -0,0 +1,70 @@
+"""
+Пересчёт таблицы RecipeScore. Каждое добавление рецепта в избранное
+или в список покупок даёт вклад, который убывает вдвое за период
+полураспада: долгий для popular и короткий для trending
+"""
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Favourite, Recipe, RecipeScore, ShoppingCart
+
+SCORES = ('popular', 'trending')
+
+
+def decay(age, half_life):
+    return math.exp(-math.log(2) * age / half_life)
+
+
+def compute_scores(now=None):
+    """
+    Проходит по избранному и спискам покупок потоком и возвращает
+    словарь {recipe_id: {'popular': ..., 'trending': ...}}
+    """
+    now = now or timezone.now()
+    half_lives = {
+        name: days * 86400
+        for name, days in settings.RECIPE_SCORE_HALF_LIFE_DAYS.items()
+    }
+    scores = defaultdict(lambda: dict.fromkeys(SCORES, 0.0))
+    sources = (
+        (Favourite, settings.RECIPE_SCORE_WEIGHTS['favourite']),
+        (ShoppingCart, settings.RECIPE_SCORE_WEIGHTS['shopping_cart']),
+    )
+    for model, weight in sources:
+        rows = model.objects.values_list('recipe_id', 'created').iterator()
+        for recipe_id, created in rows:
+            age = max((now - created).total_seconds(), 0)
+            for name in SCORES:
+                scores[recipe_id][name] += weight * decay(
+                    age, half_lives[name]
+                )
+    return scores
+
+
+def refresh_scores(batch_size=5000, now=None):
+    """
+    Заменяет содержимое таблицы одной транзакцией:
+    до коммита запросы видят прежние рейтинги. Строки рецептов,
+    созданных во время пересчёта, пропускаются через ON CONFLICT
+    """
+    scores = compute_scores(now)
+    zero = dict.fromkeys(SCORES, 0.0)
+    recipe_ids = Recipe.objects.order_by('id').values_list(
+        'id', flat=True
+    ).iterator()
+    with transaction.atomic():
+        RecipeScore.objects.all().delete()
+        batch = []
+        for recipe_id in recipe_ids:
+            batch.append(
+                RecipeScore(recipe_id=recipe_id, **scores.get(recipe_id, zero))
+            )
+            if len(batch) >= batch_size:
+                RecipeScore.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        RecipeScore.objects.bulk_create(batch, ignore_conflicts=True)
+    return len(scores)
@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .counters import change_counter
+from .images import delete_unused_variants
+from .models import Recipe, RecipeScore
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(instance, created, raw=False, **kwargs):
+    """Новый рецепт сразу попадает в ленты с сортировкой по рейтингу"""
+    if created and not raw:
+        RecipeScore.objects.create(recipe=instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_image_variants(instance, **kwargs):
+    variants = instance.image_variants
+    if variants:
+        transaction.on_commit(lambda: delete_unused_variants(variants))
@@ -26,7 +26,9 @@ class UserAdmin(DjangoUserAdmin):
         'email',
         'username',
         'first_name',
-        'last_name'
+        'last_name',
+        'recipes_count',
+        'followers_count'
     )
     list_filter = (
         'username',
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.sql import DeleteQuery, InsertQuery
 from django.conf import settings
 
 from .validators import only_letters_validator, username_validator
@@ -38,6 +39,16 @@ class User(AbstractUser):
         verbose_name='Пароль',
         help_text='Укажите пароль'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число подписчиков'
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -54,6 +65,87 @@ class User(AbstractUser):
         )
 
 
+class UserRelationQuerySet(models.QuerySet):
+    """
+    Связи пользователя с объектом (подписки, избранное, список покупок),
+    которые добавляются и удаляются одним запросом без гонок
+    """
+
+    def insert_ignoring_conflicts(self, objs, field_name):
+        """
+        Вставляет объекты одним INSERT ... ON CONFLICT DO NOTHING
+        RETURNING и возвращает значения поля field_name добавленных строк.
+        Если база не умеет RETURNING (SQLite в Django 3.2), строки
+        вставляются по одной и проверяется число изменённых строк
+        """
+        connection = connections[self.db]
+        field = self.model._meta.get_field(field_name)
+        fields = [
+            field for field in self.model._meta.concrete_fields
+            if not field.primary_key
+        ]
+        returning = connection.features.can_return_rows_from_bulk_insert
+        batches = [objs] if returning else [[obj] for obj in objs]
+        inserted = []
+        with connection.cursor() as cursor:
+            for batch in batches:
+                if not batch:
+                    continue
+                query = InsertQuery(self.model, ignore_conflicts=True)
+                query.insert_values(fields, batch)
+                compiler = query.get_compiler(self.db)
+                if returning:
+                    compiler.returning_fields = [field]
+                for sql, params in compiler.as_sql():
+                    cursor.execute(sql, params)
+                if returning:
+                    inserted.extend(row[0] for row in cursor.fetchall())
+                elif cursor.rowcount == 1:
+                    inserted.append(getattr(batch[0], field.attname))
+        return inserted
+
+    def delete_returning(self, field_name):
+        """
+        Удаляет выбранные строки одним DELETE ... RETURNING и возвращает
+        значения поля field_name удалённых строк.
+        Без RETURNING значения читаются отдельным запросом
+        """
+        connection = connections[self.db]
+        field = self.model._meta.get_field(field_name)
+        if not connection.features.can_return_columns_from_insert:
+            with transaction.atomic(using=self.db):
+                values = list(self.select_for_update().values_list(
+                    field.attname, flat=True
+                ))
+                self.delete()
+            return values
+        query = self.query.chain(DeleteQuery)
+        sql, params = query.get_compiler(self.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'{sql} RETURNING {connection.ops.quote_name(field.column)}',
+                params
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def add(self, **values):
+        """
+        Один INSERT ... ON CONFLICT DO NOTHING.
+        Возвращает True, если связь добавлена этим запросом
+        """
+        return bool(self.insert_ignoring_conflicts(
+            [self.model(**values)], self.model._meta.pk.name
+        ))
+
+    def remove(self, **values):
+        """
+        Один DELETE, у моделей связей нет сигналов и каскадов.
+        Возвращает True, если связь была удалена этим запросом
+        """
+        deleted, _ = self.filter(**values).delete()
+        return deleted > 0
+
+
 class Follow(models.Model):
     user = models.ForeignKey(
         User,
@@ -68,6 +160,8 @@ class Follow(models.Model):
         on_delete=models.CASCADE
     )
 
+    objects = UserRelationQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -81,3 +175,8 @@ class Follow(models.Model):
                 name='follow_user_author_constraint'
             )
         )
+        indexes = (
+            models.Index(
+                fields=('author', 'user'), name='follow_author_user_idx'
+            ),
+        )